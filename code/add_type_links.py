@@ -16,49 +16,151 @@ def write_output(filename, types):
         writer.writerows(types)
 
 
-def trie_insert(trie, key, value):
-    if not isinstance(key, str):
-        raise KeyError('Invalid key {}: must be a non-empty string!'.format(key))
-    if len(key) == 0:
-        trie[''] = value
-    else:
-        if not key[0] in trie:
-            trie[key[0]] = {}
-        trie_insert(trie[key[0]], key[1:], value)
-
-
-def trie_bfs(trie, max_depth=1000):
-    'Extract all values from the trie.'
-    queue = [(0, trie)]
-    results = []
-    while queue:
-        (depth, node) = queue.pop(0)
-        if '' in node:
-            results.append((depth, node['']))
-        if depth < max_depth:
-            queue.extend([(depth+1, child) for key, child in node.items() if key != ''])
-    return results
-
-
-def trie_match(trie, query, depth=0, min_depth=0, max_bfs_depth=1000):
-    if not query:
-        return depth, [(0, trie[''])] if '' in trie else []
-    if query[0] not in trie:
-        if depth >= min_depth:
-            return depth, trie_bfs(trie, max_depth=max_bfs_depth)
-        else:
-            return depth, []
-    else:
-        return trie_match(trie[query[0]], query[1:], depth=depth+1)
+class TypeNameTrie:
+    '''A trie of type names. The nodes are numbered (0 is the root) and
+       their transitions and values are stored in lists indexed by node.'''
+
+    def __init__(self):
+        self.children = [{}]
+        self.values = [None]
+        self.nearest = None
+        self.chars = set()
+
+    def insert(self, key, value):
+        node = 0
+        for c in key:
+            child = self.children[node].get(c)
+            if child is None:
+                child = len(self.values)
+                self.children[node][c] = child
+                self.children.append({})
+                self.values.append(None)
+            node = child
+        self.values[node] = value
+        self.chars.update(key)
+        self.nearest = None
+
+    def _compute_nearest(self):
+        # For every node, the closest name ending in its subtree, as
+        # (distance, value). Ties are broken by the order of insertion of
+        # the children, as in a breadth-first search. Children always
+        # have higher numbers than their parents.
+        self.nearest = [None] * len(self.values)
+        for node in range(len(self.values)-1, -1, -1):
+            if self.values[node] is not None:
+                self.nearest[node] = (0, self.values[node])
+                continue
+            for child in self.children[node].values():
+                if self.nearest[child] is not None \
+                        and (self.nearest[node] is None \
+                             or self.nearest[child][0]+1 < self.nearest[node][0]):
+                    self.nearest[node] = (self.nearest[child][0]+1,
+                                          self.nearest[child][1])
+
+    def match(self, text, start=0):
+        '''Follow `text` from position `start` down the trie as far as
+           possible. Returns (j, d, value), where j is the length of the
+           matched prefix and `value` belongs to the name that completes
+           it with the fewest (d) additional characters, or None if
+           nothing matched or the text ended before reaching a name.'''
+        if self.nearest is None:
+            self._compute_nearest()
+        node, i = 0, start
+        while i < len(text):
+            child = self.children[node].get(text[i])
+            if child is None:
+                break
+            node, i = child, i+1
+        if node == 0:
+            return None
+        if i == len(text):
+            if self.values[node] is None:
+                return None
+            return i-start, 0, self.values[node]
+        return (i-start,) + self.nearest[node]
 
 
 def build_type_names_trie(types):
-    trie = {}
+    trie = TypeNameTrie()
     for t in types:
-        trie_insert(trie, t['type_name'], t['type_id'])
+        trie.insert(t['type_name'], t['type_id'])
     return trie
 
 
+REF_MARKER = '&gt;'
+
+
+def _link_target(text, i, trie, threshold):
+    # The link for a reference marker at position `i` as (type_id, link
+    # text, end of the link text), or None.
+    start = i+len(REF_MARKER)
+    m = trie.match(text, start)
+    if m is None:
+        return None
+    j, d, value = m
+    if not j/(j+d) > threshold:
+        return None
+    k = start+j
+    while k < len(text) and text[k].isalpha():
+        k += 1
+    return value, text[start:k], k
+
+
+def _add_links_sequential(text, trie, threshold):
+    # Link the references one by one, replacing every occurrence of
+    # a reference as soon as it is found.
+    i = text.find(REF_MARKER)
+    while i > -1:
+        link = _link_target(text, i, trie, threshold)
+        if link is not None:
+            value, linktext, k = link
+            text = text.replace(
+                REF_MARKER+linktext,
+                '{}[{}|{}]'.format(REF_MARKER, value, linktext))
+        i = text.find(REF_MARKER, i+1)
+    return text
+
+
+def add_links(text, trie, threshold):
+    '''Convert the references (`&gt;` followed by a type name or its
+       prefix) in `text` to links `&gt;[type_id|name]`. A link text
+       found at one reference is linked wherever it occurs after a
+       marker, like with `str.replace`.'''
+    markers = []
+    i = text.find(REF_MARKER)
+    while i > -1:
+        markers.append(i)
+        i = text.find(REF_MARKER, i+1)
+    if not markers:
+        return text
+    if '[' in trie.children[0] or '&' in trie.chars:
+        # Links could themselves be references or break up markers, so
+        # the result depends on the order of the replacements.
+        return _add_links_sequential(text, trie, threshold)
+    links = {}
+    for n, i in enumerate(markers):
+        if n in links:
+            continue
+        link = _link_target(text, i, trie, threshold)
+        if link is None:
+            continue
+        value, linktext, k = link
+        for n2, i2 in enumerate(markers):
+            if n2 not in links \
+                    and text.startswith(linktext, i2+len(REF_MARKER)):
+                links[n2] = (value, linktext)
+    result, last = [], 0
+    for n, i in enumerate(markers):
+        if n in links:
+            value, linktext = links[n]
+            start = i+len(REF_MARKER)
+            result.append(text[last:start])
+            result.append('[{}|{}]'.format(value, linktext))
+            last = start+len(linktext)
+    result.append(text[last:])
+    return ''.join(result)
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser(
         description='Search type descriptions for references to other '
@@ -79,21 +181,9 @@ if __name__ == '__main__':
     args = parse_arguments()
     types = read_input(args.filename)
     trie = build_type_names_trie(types)
-    names = { t['type_id']: t['type_name'] for t in types }
     for t in types:
-        i = t['type_description'].find('&gt;')
-        while i > -1:
-            query = t['type_description'][i+len('&gt;'):]
-            j, matches = trie_match(trie, query, min_depth=7, max_bfs_depth=5)
-            if matches and j/(j+matches[0][0]) > args.threshold:
-                k = i+len('&gt;')+j
-                while k < len(t['type_description']) and t['type_description'][k].isalpha():
-                    k += 1
-                linktext = t['type_description'][i+len('&gt;'):k]
-                t['type_description'] = t['type_description'].replace(
-                    '&gt;'+linktext,
-                    '&gt;[{}|{}]'.format(matches[0][1], linktext))
-            i = t['type_description'].find('&gt;', i+1)
+        t['type_description'] = \
+            add_links(t['type_description'], trie, args.threshold)
     output_file = args.output_file if args.output_file is not None else args.filename
     write_output(output_file, types)
 
@@ -2,21 +2,50 @@
 
 import argparse
 import csv
+from functools import lru_cache
+import itertools
 import logging
+from multiprocessing import Pool
 import re
 import sys
 
+from table_io import table_reader
 
+
+DIGITS = str.maketrans('', '', '0123456789')
+TAG_PATTERN = re.compile(r'</?([A-Z]+)>')
+TRAILING_PATTERN = re.compile(r' \W+$')
+LEADING_PATTERN = re.compile(r'^\W+ ')
+SPACE_PATTERN = re.compile(r'\s+')
+NONWORD_PATTERN = re.compile(r'\W')
+
+
+# The same verses recur many times in the corpus, so caching pays off.
+@lru_cache(maxsize=1 << 18)
 def clean(string):
-    string = re.sub('[0-9]', '', string)
-    string = re.sub('<\/?([A-Z]+)>', '', string)
+    string = string.translate(DIGITS)
+    string = TAG_PATTERN.sub('', string)
     string = string.lower().strip()
-    string = re.sub(' \W+$', '', string)
-    string = re.sub('^\W+ ', '', string)
-    string = re.sub('\s+', '_', string)
-    string = re.sub('\W', '', string)
-    string = re.sub('_', ' ', string)
-    return string
+    string = TRAILING_PATTERN.sub('', string)
+    string = LEADING_PATTERN.sub('', string)
+    string = SPACE_PATTERN.sub('_', string)
+    string = NONWORD_PATTERN.sub('', string)
+    return string.replace('_', ' ')
+
+
+def clean_all(strings):
+    return [clean(s) for s in strings]
+
+
+def read_chunks(reader, size):
+    chunk = []
+    for row in reader:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 def parse_arguments():
@@ -24,19 +53,41 @@ def parse_arguments():
     parser.add_argument(
         '-c', '--column', default='text',
         help='The name of the column containing the text to clean.')
+    parser.add_argument(
+        '-j', '--workers', type=int, default=1,
+        help='Number of processes to clean the verses in (default: 1).')
+    parser.add_argument(
+        '--chunk-size', type=int, default=10000,
+        help='Number of rows sent to a process at once (default: 10000).')
     return parser.parse_args()
 
 
 if __name__ == '__main__':
     args = parse_arguments()
-    reader = csv.DictReader(sys.stdin)
-    writer = csv.DictWriter(sys.stdout, reader.fieldnames, lineterminator='\n')
-    writer.writeheader()
-    for i, row in enumerate(reader, 1):
-        if args.column in row:
-            row[args.column] = clean(row[args.column])
+    with table_reader(sys.stdin) as reader:
+        writer = csv.DictWriter(sys.stdout, reader.fieldnames, lineterminator='\n')
+        writer.writeheader()
+        if args.workers > 1 and args.column in reader.fieldnames:
+            with Pool(args.workers) as pool:
+                chunks = read_chunks(reader, args.chunk_size)
+                while True:
+                    # a few chunks per process at a time to bound memory
+                    batch = list(itertools.islice(chunks, 2*args.workers))
+                    if not batch:
+                        break
+                    # pass only the texts to the workers, keep the rows here
+                    results = pool.map(clean_all, \
+                        [[row[args.column] for row in chunk] for chunk in batch])
+                    for chunk, cleaned in zip(batch, results):
+                        for row, text in zip(chunk, cleaned):
+                            row[args.column] = text
+                        writer.writerows(chunk)
         else:
-            logging.warn('Record {} contains no field \'{}\''\
-                         .format(i, args.column))
-        writer.writerow(row)
+            for i, row in enumerate(reader, 1):
+                if args.column in row:
+                    row[args.column] = clean(row[args.column])
+                else:
+                    logging.warn('Record {} contains no field \'{}\''\
+                                 .format(i, args.column))
+                writer.writerow(row)
 
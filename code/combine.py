@@ -0,0 +1,158 @@
+'''Combine the per-collection work tables into the output tables.
+
+In the standard case, a combined table is just the concatenation of the
+tables for the individual collections (like `csvstack`, with the union of
+their columns). The poem-level metadata tables are derived from `meta.csv`
+for the collections that do not have them (like `csvcut` and `csvgrep`).
+Each work table is read only once, even if it contributes to several
+output tables.'''
+
+import argparse
+import csv
+import os.path as P
+
+
+COLLECTIONS = ('skvr', 'jr', 'kr')
+
+
+class Source:
+    '''A part of an output table taken from one work table: `columns` is
+       a list of columns to cut (default: all) and `non_empty` a column
+       that must be non-empty for the row to be kept.'''
+
+    def __init__(self, collection, table, columns=None, non_empty=None):
+        self.collection = collection
+        self.table = table
+        self.columns = columns
+        self.non_empty = non_empty
+
+
+def stack(table, collections):
+    return [Source(c, table) for c in collections]
+
+
+def poem_meta(table, column):
+    # SKVR: csvcut only, KR: csvcut + csvgrep on non-empty values
+    return [Source('skvr', 'meta.csv', ('poem_id', column)),
+            Source('jr', table),
+            Source('kr', 'meta.csv', ('poem_id', column), non_empty=column)]
+
+
+# output table => (sources, output columns or None for the union)
+TABLES = {
+    'collectors.csv': (stack('collectors.csv', ('skvr', 'kr')), None),
+    'places.csv': (stack('places.csv', ('skvr', 'kr')), None),
+    'poems.csv': (stack('poems.csv', COLLECTIONS), None),
+    'poem_collector.csv': (poem_meta('poem_collector.csv', 'collector_id'), None),
+    'poem_place.csv': (poem_meta('poem_place.csv', 'place_id'), None),
+    'poem_types.csv': (stack('poem_types.csv', ('skvr', 'kr')), None),
+    'poem_year.csv': (poem_meta('poem_year.csv', 'year'), None),
+    'raw_meta.csv': (stack('raw_meta.csv', COLLECTIONS), None),
+    'refs.csv': (stack('refs.csv', ('skvr', 'jr')), None),
+    # Here we only keep columns that are present in all subcorpora.
+    # (`type_comparison` is only present in SKVR)
+    'types.csv': (stack('types.csv', ('skvr', 'kr')),
+                  ('type_id', 'type_name', 'type_description', 'type_parent_id')),
+    'verses.csv': (stack('verses.csv', COLLECTIONS), None),
+    'verses_cl.csv': (stack('verses_cl.csv', COLLECTIONS), None),
+    'word_occ.csv': (stack('word_occ.csv', COLLECTIONS), None),
+}
+
+
+def read_header(filename):
+    with open(filename, newline='') as fp:
+        return next(csv.reader(fp), [])
+
+
+def combine(tables, work_dir, output_dir):
+    '''Write the given output tables, reading every work table once.'''
+
+    def path(source):
+        return P.join(work_dir, source.collection, source.table)
+
+    headers = {}
+    for sources, columns in tables.values():
+        for s in sources:
+            if path(s) not in headers:
+                headers[path(s)] = read_header(path(s))
+    # for every work table: [(writer, column indices, non-empty index)]
+    targets = { path(s): [] for sources, columns in tables.values() \
+                            for s in sources }
+    outfiles = []
+    try:
+        for table, (sources, columns) in tables.items():
+            if columns is None:
+                columns = []
+                for s in sources:
+                    for c in s.columns or headers[path(s)]:
+                        if c not in columns:
+                            columns.append(c)
+            fp = open(P.join(output_dir, table), 'w+', newline='')
+            outfiles.append(fp)
+            writer = csv.writer(fp, lineterminator='\n')
+            writer.writerow(columns)
+            for s in sources:
+                header = headers[path(s)]
+                s_columns = s.columns or header
+                idx = [header.index(c) if c in s_columns else None \
+                       for c in columns]
+                if idx == list(range(len(header))):
+                    idx = None          # copy the whole row
+                non_empty = header.index(s.non_empty) \
+                            if s.non_empty is not None else None
+                targets[path(s)].append((writer, idx, non_empty))
+        # the work tables are read in the order of collections, which is
+        # also the order of the sources of every output table
+        order = sorted(targets, key=lambda p: COLLECTIONS.index(
+                           P.basename(P.dirname(p))))
+        for filename in order:
+            with open(filename, newline='') as fp:
+                reader = csv.reader(fp)
+                next(reader, None)
+                if len(targets[filename]) == 1 \
+                        and targets[filename][0][1:] == (None, None):
+                    targets[filename][0][0].writerows(reader)
+                    continue
+                for row in reader:
+                    for writer, idx, non_empty in targets[filename]:
+                        if non_empty is not None and not row[non_empty]:
+                            continue
+                        if idx is None:
+                            writer.writerow(row)
+                        else:
+                            writer.writerow(
+                                [row[i] if i is not None and i < len(row) \
+                                 else '' for i in idx])
+    finally:
+        for fp in outfiles:
+            fp.close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Combine the per-collection work tables.')
+    parser.add_argument(
+        '-w', '--work-dir', metavar='PATH', default='data/work',
+        help='The directory containing a subdirectory for each collection.')
+    parser.add_argument(
+        '-d', '--output-dir', metavar='PATH', default='.',
+        help='The directory to write the combined tables to.')
+    parser.add_argument(
+        'tables', nargs='*', metavar='TABLE',
+        help='The tables to write (default: all).')
+    args = parser.parse_args()
+    for t in args.tables:
+        if t not in TABLES:
+            parser.error('unknown table: {} (choose from {})'\
+                         .format(t, ', '.join(TABLES)))
+    return args
+
+
+def main():
+    args = parse_arguments()
+    tables = { t: TABLES[t] for t in (args.tables or TABLES) }
+    combine(tables, args.work_dir, args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
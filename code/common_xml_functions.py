@@ -6,12 +6,12 @@ from operator import itemgetter
 from typing import Any
 import _csv
 import re
+from xml.sax.saxutils import escape
 
 # %%
 
 
-def elem_content_to_str(elem: ET.Element) -> str:
-    '''Get the node's content as string, but without surrounding tags.'''
+def _elem_content_to_str_by_pattern(elem: ET.Element) -> str:
     text = ET.tostring(elem, encoding='unicode')
     pattern = '<{}>(.*)</{}>'.format(elem.tag, elem.tag)
     m = re.match(pattern, text, flags=re.DOTALL)
@@ -25,18 +25,58 @@ def elem_content_to_str(elem: ET.Element) -> str:
         return elem.text
 
 
+def _serialize(elem: ET.Element, parts: list) -> None:
+    '''Serialize an element (including its tail) like `ET.tostring()`.'''
+    tag = elem.tag
+    if not isinstance(tag, str) or '{' in tag:
+        raise ValueError('Cannot serialize: {}'.format(tag))
+    if elem.attrib:
+        parts.append(ET.tostring(elem, encoding='unicode'))
+        return
+    if elem.text or len(elem):
+        parts.append('<' + tag + '>')
+        if elem.text:
+            parts.append(escape(elem.text))
+        for child in elem:
+            _serialize(child, parts)
+        parts.append('</' + tag + '>')
+    else:
+        parts.append('<' + tag + ' />')
+    if elem.tail:
+        parts.append(escape(elem.tail))
+
+
+def elem_content_to_str(elem: ET.Element) -> str:
+    '''Get the node's content as string, but without surrounding tags.'''
+    # Elements with attributes, namespaces, comments or processing
+    # instructions are handled by matching the serialization of the whole
+    # element, as this is the rare case.
+    if elem.attrib or not isinstance(elem.tag, str) or '{' in elem.tag:
+        return _elem_content_to_str_by_pattern(elem)
+    if not len(elem):
+        return escape(elem.text) if elem.text else ''
+    parts = [escape(elem.text)] if elem.text else []
+    try:
+        for child in elem:
+            _serialize(child, parts)
+    except ValueError:
+        return _elem_content_to_str_by_pattern(elem)
+    return ''.join(parts)
+
+
+REFNRS_PATTERN = re.compile('(^|[^&])(#([0-9]+)(\u2020|&#8224;)?,?)+')
+REFNR_PATTERN = re.compile('(#([0-9]+)(\u2020|&#8224;)?)')
+
+
+def _replace_refnrs(m: re.Match) -> str:
+    refnrs = REFNR_PATTERN.findall(m.group(0))
+    return m.group(1) + '<REFNR>' + ','.join(map(itemgetter(1), refnrs)) \
+           + '</REFNR>'
+
+
 def insert_refnrs(text: str) -> str:
     '''Convert the references like #1 or #1† to XML: <REFNR>1</REFNR>.'''
-    result = ''
-    m = re.search('(^|[^&])(#([0-9]+)(\u2020|&#8224;)?,?)+', text)
-    while m is not None:
-        refnrs = re.findall('(#([0-9]+)(\u2020|&#8224;)?)', m.group(0))
-        result += text[:m.start()] + m.group(1) + \
-                  '<REFNR>' + ','.join(map(itemgetter(1), refnrs)) + '</REFNR>'
-        text = text[m.end():]
-        m = re.search('(^|[^&])(#([0-9]+)(\u2020|&#8224;)?,?)+', text)
-    result += text
-    return result
+    return REFNRS_PATTERN.sub(_replace_refnrs, text)
 
 
 def parse_skvr_refs(elem: ET.Element) -> ET.Element:
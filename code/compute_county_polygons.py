@@ -1,4 +1,8 @@
 import argparse
+import hashlib
+from multiprocessing import Pool
+import os
+import os.path as P
 import pandas as pd
 import geopandas as gpd
 import shapely
@@ -8,11 +12,76 @@ def fill_holes(geometry, max_area=0):
     if type(geometry) == shapely.geometry.multipolygon.MultiPolygon:
         polygons = [fill_holes(p, max_area) for p in geometry.geoms]
         return shapely.geometry.multipolygon.MultiPolygon(polygons)
-    holes = [shapely.geometry.Polygon(i) for i in geometry.interiors]
-    for h in holes:
-        if h.area <= max_area:
-            geometry = geometry.union(h)
-    return geometry
+    # rebuild the polygon from the exterior and the holes to keep
+    interiors = [i for i in geometry.interiors \
+                 if shapely.geometry.Polygon(i).area > max_area]
+    return shapely.geometry.Polygon(geometry.exterior, interiors)
+
+
+def county_polygon(args):
+    '''Merge the parish polygons (WKB) of a county. Returns the county
+       polygon as WKB.'''
+    wkbs, grid_size, max_area = args
+    geometry = shapely.unary_union([shapely.from_wkb(g) for g in wkbs],
+                                   grid_size=grid_size)
+    return shapely.to_wkb(fill_holes(geometry, max_area=max_area))
+
+
+def params_hash(grid_size, max_area):
+    '''Hash everything except the input polygons that a county polygon
+       depends on: the parameters, this script and the version of
+       shapely.'''
+    h = hashlib.sha256()
+    with open(P.abspath(__file__), 'rb') as fp:
+        h.update(fp.read())
+    h.update(repr((grid_size, max_area, shapely.__version__)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def county_cache_key(wkbs, params_hash):
+    h = hashlib.sha256(params_hash.encode('utf-8'))
+    for g in wkbs:
+        h.update(len(g).to_bytes(8, 'little'))
+        h.update(g)
+    return h.hexdigest()
+
+
+def county_polygons(geometries, grid_size, max_area, workers=1,
+                    cache_dir=None):
+    '''Compute the county polygons from lists of parish polygons, in
+       a process pool if `workers` > 1. If `cache_dir` is given, the
+       polygons are kept there, keyed by a hash of the parish polygons,
+       and only the counties whose parishes have changed are computed.'''
+    wkbs = [[shapely.to_wkb(g) for g in gs] for gs in geometries]
+    results, tasks = [None] * len(wkbs), []
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        p_hash = params_hash(grid_size, max_area)
+        keys = [county_cache_key(w, p_hash) for w in wkbs]
+        for i, key in enumerate(keys):
+            filename = P.join(cache_dir, key + '.wkb')
+            if P.isfile(filename):
+                with open(filename, 'rb') as fp:
+                    results[i] = fp.read()
+            else:
+                tasks.append(i)
+    else:
+        tasks = list(range(len(wkbs)))
+    args = [(wkbs[i], grid_size, max_area) for i in tasks]
+    if workers > 1 and len(tasks) > 1:
+        with Pool(workers) as pool:
+            computed = pool.map(county_polygon, args, chunksize=1)
+    else:
+        computed = map(county_polygon, args)
+    for i, result in zip(tasks, computed):
+        results[i] = result
+        if cache_dir is not None:
+            filename = P.join(cache_dir, keys[i] + '.wkb')
+            tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+            with open(tmp_filename, 'wb') as fp:
+                fp.write(result)
+            os.replace(tmp_filename, filename)
+    return [shapely.from_wkb(r) for r in results]
 
 
 def parse_arguments():
@@ -34,6 +103,13 @@ def parse_arguments():
     parser.add_argument(
         '-H', '--fill-hole-area', metavar='AREA', default=0.0, type=float,
         help='Fill holes in polygons smaller than AREA.')
+    parser.add_argument(
+        '-j', '--workers', type=int, metavar='N', default=1,
+        help='Merge the polygons in N parallel processes (default: 1).')
+    parser.add_argument(
+        '--cache-dir', metavar='PATH',
+        help='Keep the county polygons in PATH and recompute only those'
+             ' whose parish polygons have changed.')
     return parser.parse_args()
 
 
@@ -45,7 +121,7 @@ if __name__ == '__main__':
     poly_place = pd.read_csv(args.polygon_to_place_file)
 
     # join the tables and merge parish polygons to county polygons
-    counties = (
+    parishes = (
         areas.merge(poly_place, left_on = 'id', right_on = 'polygon_id')
             .merge(places)
             .merge(places, left_on = 'place_parent_id', right_on = 'place_id')
@@ -53,23 +129,21 @@ if __name__ == '__main__':
               'parish_language', 'geometry']]
             .rename(columns = { 'place_id_y': 'place_id',
                                 'place_name_y': 'county_name' })
-            .groupby('place_id')
-            .apply(lambda x: gpd.GeoDataFrame({
-                'county_name': x['county_name'].iloc[:1],
-                'parish_place_ids': [list(x['place_id_x'])],
-                'county_language': [x['parish_language'].mode()[0]] \
-                    if not x['parish_language'].mode().empty else [None],
-                'geometry': [fill_holes(
-                    shapely.unary_union(x['geometry'].to_list(),
-                                        grid_size=args.grid_size),
-                    max_area = args.fill_hole_area)],
-                },
-                crs=areas.crs))
-            .reset_index()
-           [['place_id', 'parish_place_ids', 'county_name',
-             'county_language', 'geometry']]
     )
+    groups = [x for place_id, x in parishes.groupby('place_id')]
+    geometries = county_polygons(
+        [x['geometry'].to_list() for x in groups],
+        args.grid_size, args.fill_hole_area,
+        workers=args.workers, cache_dir=args.cache_dir)
+    counties = gpd.GeoDataFrame({
+        'place_id': [x['place_id'].iloc[0] for x in groups],
+        'parish_place_ids': [list(x['place_id_x']) for x in groups],
+        'county_name': [x['county_name'].iloc[0] for x in groups],
+        'county_language': [x['parish_language'].mode()[0] \
+                            if not x['parish_language'].mode().empty \
+                            else None for x in groups],
+        'geometry': geometries,
+        }, crs=areas.crs)
     counties = counties.assign(id = areas['id'].max() + counties.index + 1)
     
     print(counties.to_json())
-
@@ -10,6 +10,7 @@ import sys
 from common_xml_functions import elem_content_to_str
 # TODO restructure -- these are now also common functions
 from convert_skvr import read_inputs, transform_rows, map_meta
+from table_io import table_filename, table_writer
 
 # Names of input files.
 FILENAMES = {
@@ -234,9 +235,7 @@ def read_csv(filename):
 
 
 def write_csv(rows, filename, fieldnames):
-    with open(filename, 'w+') as fp:
-        writer = csv.DictWriter(fp, fieldnames)
-        writer.writeheader()
+    with table_writer(filename, fieldnames) as writer:
         writer.writerows(rows)
 
 
@@ -259,6 +258,9 @@ def parse_arguments():
     parser.add_argument(
         '-d', '--output-dir', metavar='PATH', default='.',
         help='The directory to write output files to.')
+    parser.add_argument(
+        '-f', '--format', choices=['csv', 'parquet'], default='csv',
+        help='The format of the output tables (default: csv).')
     return parser.parse_args()
 
 
@@ -266,26 +268,31 @@ if __name__ == '__main__':
     args = parse_arguments()
     if args.xml_files:
         inputs = read_inputs(args.xml_files, args.prefix, collection='erab')
-        transform_rows(inputs, mappers, output_dir=args.output_dir)
+        transform_rows(inputs, mappers, output_dir=args.output_dir,
+                       fmt=args.format)
 
     if args.csv_input_dir is not None:
 
         # transform places
         write_csv(read_places(args.csv_input_dir),
-                  P.join(args.output_dir, 'places.csv'),
+                  P.join(args.output_dir,
+                         table_filename('places.csv', args.format)),
                   ('place_id', 'place_name', 'place_type', 'place_parent_id'))
         write_csv(read_poem_place(args.csv_input_dir, check=True),
-                  P.join(args.output_dir, 'poem_place.csv'),
+                  P.join(args.output_dir,
+                         table_filename('poem_place.csv', args.format)),
                   ('poem_id', 'place_id'))
 
         # transform collectors
         transform_csv(P.join(args.csv_input_dir, FILENAMES['collectors']),
-                      P.join(args.output_dir, 'collectors.csv'),
+                      P.join(args.output_dir,
+                             table_filename('collectors.csv', args.format)),
                       ('collector_id', 'collector_name'),
                       lambda row: {'collector_id': PREFIX+row['koguja_id'],
                                    'collector_name': row['nimi']})
         transform_csv(P.join(args.csv_input_dir, FILENAMES['poem_collector']),
-                      P.join(args.output_dir, 'poem_collector.csv'),
+                      P.join(args.output_dir,
+                             table_filename('poem_collector.csv', args.format)),
                       ('poem_id', 'collector_id'),
                       lambda row: {'poem_id': row['laul_id'],
                                    'collector_id': PREFIX+row['koguja_id']})
@@ -296,19 +303,19 @@ if __name__ == '__main__':
         # to be used anywhere in the output data. In the old index, this is the
         # type name directly.
         types_dict = {}
-        with open(P.join(args.output_dir, 'types.csv'), 'w+') as fp:
-            fieldnames = ('type_id', 'type_name',
-                          'type_description', 'type_parent_id')
-            writer = csv.DictWriter(fp, fieldnames)
-            writer.writeheader()
+        fieldnames = ('type_id', 'type_name',
+                      'type_description', 'type_parent_id')
+        with table_writer(P.join(args.output_dir,
+                                 table_filename('types.csv', args.format)),
+                          fieldnames) as writer:
             for t in read_types(args.csv_input_dir):
                 types_dict[t['internal_id']] = t['type_id']
                 del t['internal_id']
                 writer.writerow(t)
 
-        with open(P.join(args.output_dir, 'poem_types.csv'), 'w+') as outfp:
-            writer = csv.DictWriter(outfp, ('poem_id', 'type_id', 'type_is_minor'))
-            writer.writeheader()
+        with table_writer(P.join(args.output_dir,
+                                 table_filename('poem_types.csv', args.format)),
+                          ('poem_id', 'type_id', 'type_is_minor')) as writer:
             for row in read_csv(P.join(args.csv_input_dir, FILENAMES['poem_type'])):
                 if row['hierarhia_id'] != '1':
                     writer.writerow({ 'poem_id': row['laul_id'],
@@ -321,7 +328,8 @@ if __name__ == '__main__':
 
         # genres
         transform_csv(P.join(args.csv_input_dir, FILENAMES['genres']),
-                      P.join(args.output_dir, 'genres.csv'),
+                      P.join(args.output_dir,
+                             table_filename('genres.csv', args.format)),
                       ('genre_id', 'genre_name', 'genre_comment'),
                       lambda row: {'genre_id': row['id'],
                                    'genre_name': row['nimi'],
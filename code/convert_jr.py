@@ -1,6 +1,4 @@
 import argparse
-import csv
-import lxml.etree as ET
 import logging
 import os.path as P
 
@@ -8,6 +6,8 @@ from common_xml_functions import \
     elem_content_to_str, \
     insert_refnrs, \
     parse_skvr_refs
+from convert_skvr import convert_files, iter_items, transform_rows
+from filter_items_by_year import ItemFilter
 
 
 #########################################################################
@@ -98,30 +98,18 @@ mappers = {
 }
 
 
-def transform_rows(input_rows, mappers, output_dir='.'):
-    '''Applies the mappers to an iterator over input rows.'''
-
-    outfiles = { m_file: open(P.join(output_dir, m_file), 'w+') \
-                         for m_file in mappers }
-    writers = { m_file: csv.DictWriter(outfiles[m_file], m_header)
-                for m_file, (m_header, m_func) in mappers.items() }
-    for writer in writers.values():
-        writer.writeheader()
-    for row in input_rows:
-        for m_file, (m_header, m_func) in mappers.items():
-            writers[m_file].writerows(m_func(row))
-    for fp in outfiles.values():
-        fp.close()
-
-
-def read_inputs(filenames, prefix):
+def read_inputs(filenames, prefix, item_filter=None):
     '''Transforms the XML files to an iterator over rows, each row
-       corresponding to one ITEM.'''
+       corresponding to one ITEM. If `item_filter` is given, only the
+       ITEMs for which `item_filter(filename, node)` is true are read.'''
     for filename in filenames:
         if not P.isfile(filename):
             logging.warning('Skipping "{}": file does not exist'.format(filename))
             continue
-        for node in ET.parse(filename).getroot():
+        for node in iter_items(filename):
+            if item_filter is not None \
+                    and not item_filter(filename, node, nested=True):
+                continue
             meta = node.xpath('./META')
             text = node.xpath('./TEXT')
             refs = node.xpath('./REFS')
@@ -148,6 +136,8 @@ def read_inputs(filenames, prefix):
                 'refsxml'      : refs[0] if refs else None
             }
             yield item
+        if item_filter is not None:
+            item_filter.finish_file(filename)
 
 
 def parse_arguments():
@@ -158,6 +148,26 @@ def parse_arguments():
     parser.add_argument(
         '-d', '--output-dir', metavar='PATH', default='.',
         help='The directory to write output files to.')
+    parser.add_argument(
+        '--max-year', type=int, metavar='YEAR',
+        help='Only convert items recorded in or before YEAR.')
+    parser.add_argument(
+        '--min-year', type=int, metavar='YEAR',
+        help='Only convert items recorded in or after YEAR.')
+    parser.add_argument(
+        '--filter-log-dir', metavar='PATH',
+        help='The directory to write the filtering logs to'
+             ' (default: the output directory).')
+    parser.add_argument(
+        '-j', '--workers', type=int, metavar='N', default=1,
+        help='Convert the XML files in N parallel processes (default: 1).')
+    parser.add_argument(
+        '--cache-dir', metavar='PATH',
+        help='Keep the converted tables of each XML file in PATH and'
+             ' reconvert only the files that have changed.')
+    parser.add_argument(
+        '-f', '--format', choices=['csv', 'parquet'], default='csv',
+        help='The format of the output tables (default: csv).')
     return parser.parse_args()
 
 
@@ -165,6 +175,20 @@ if __name__ == '__main__':
     args = parse_arguments()
 
     if args.xml_files:
-        inputs = read_inputs(args.xml_files, prefix='')
-        transform_rows(inputs, mappers, output_dir=args.output_dir)
+        item_filter = None
+        if args.max_year is not None or args.min_year is not None:
+            item_filter = ItemFilter(max_year=args.max_year,
+                                     min_year=args.min_year)
+        if args.workers > 1 or args.cache_dir is not None:
+            convert_files(args.xml_files, read_inputs, ('',), mappers,
+                          output_dir=args.output_dir,
+                          item_filter=item_filter, workers=args.workers,
+                          cache_dir=args.cache_dir, fmt=args.format)
+        else:
+            inputs = read_inputs(args.xml_files, prefix='',
+                                 item_filter=item_filter)
+            transform_rows(inputs, mappers, output_dir=args.output_dir,
+                           fmt=args.format)
+        if item_filter is not None:
+            item_filter.write_logs(args.filter_log_dir or args.output_dir)
 
@@ -1,10 +1,17 @@
 import argparse
+from contextlib import ExitStack
 import csv
+import hashlib
 import json
 import lxml.etree as ET
 import logging
+from multiprocessing import Pool
+import os
 import os.path as P
 import re
+import shutil
+import sys
+import tempfile
 
 # FIXME despite the name, this script right now is made for both SKVR and KR.
 # Eventually, it will be merged with the scripts for ERAB and JR as well.
@@ -13,6 +20,8 @@ from common_xml_functions import \
     elem_content_to_str, \
     insert_refnrs, \
     parse_skvr_refs
+from filter_items_by_year import ItemFilter
+from table_io import table_filename, table_writer
 
 
 PREFIX = 'skvr_'
@@ -97,20 +106,18 @@ mappers = {
 }
 
 
-def transform_rows(input_rows, mappers, output_dir='.'):
+def transform_rows(input_rows, mappers, output_dir='.', write_header=True,
+                   fmt='csv'):
     '''Applies the mappers to an iterator over input rows.'''
 
-    outfiles = { m_file: open(P.join(output_dir, m_file), 'w+') \
-                         for m_file in mappers }
-    writers = { m_file: csv.DictWriter(outfiles[m_file], m_header)
-                for m_file, (m_header, m_func) in mappers.items() }
-    for writer in writers.values():
-        writer.writeheader()
-    for row in input_rows:
-        for m_file, (m_header, m_func) in mappers.items():
-            writers[m_file].writerows(m_func(row))
-    for fp in outfiles.values():
-        fp.close()
+    with ExitStack() as stack:
+        writers = { m_file: stack.enter_context(table_writer(
+                        P.join(output_dir, table_filename(m_file, fmt)),
+                        m_header, write_header=write_header)) \
+                    for m_file, (m_header, m_func) in mappers.items() }
+        for row in input_rows:
+            for m_file, (m_header, m_func) in mappers.items():
+                writers[m_file].writerows(m_func(row))
 
 
 def read_csv(filename, encoding='utf-8'):
@@ -217,20 +224,37 @@ def read_skvr_poem_types(filename, prefix):
 
 
 def transform_hash(inputs, outfile, fieldnames, mapper):
-    with open(outfile, 'w+') as fp:
-        writer = csv.DictWriter(fp, fieldnames)
-        writer.writeheader()
+    with table_writer(outfile, fieldnames) as writer:
         writer.writerows(mapper(inputs))
 
 
-def read_inputs(filenames, prefix, collection):
+def iter_items(filename):
+    '''Iterate over the ITEMs that are children of the root element,
+       parsing the file incrementally. Each ITEM is cleared, together with
+       its preceding siblings, when the iteration resumes, so the item
+       must be fully processed before requesting the next one.'''
+    for event, node in ET.iterparse(filename, tag='ITEM'):
+        parent = node.getparent()
+        if parent is None or parent.getparent() is not None:
+            continue
+        yield node
+        node.clear()
+        while node.getprevious() is not None:
+            del parent[0]
+
+
+def read_inputs(filenames, prefix, collection, item_filter=None):
     '''Transforms the XML files to an iterator over rows, each row
-       corresponding to one ITEM.'''
+       corresponding to one ITEM. If `item_filter` is given, only the
+       ITEMs for which `item_filter(filename, node)` is true are read.'''
     for filename in filenames:
         if not P.isfile(filename):
             logging.warning('Skipping "{}": file does not exist'.format(filename))
             continue
-        for node in ET.parse(filename).getroot():
+        for node in iter_items(filename):
+            if item_filter is not None \
+                    and not item_filter(filename, node, nested=True):
+                continue
             meta = node.xpath('./META')
             text = node.xpath('./TEXT')
             refs = node.xpath('./REFS')
@@ -249,6 +273,130 @@ def read_inputs(filenames, prefix, collection):
                 'refsxml'      : refs[0] if refs else None
             }
             yield item
+        if item_filter is not None:
+            item_filter.finish_file(filename)
+
+
+def _convert_file(args):
+    '''Convert a single file to headerless partial outputs in `shard_dir`.
+       Returns the filtering logs of the file.
+
+       If `cache_key` is given, the shard is kept in `shard_dir` together
+       with the logs, and reused if it already exists.'''
+    filename, read_fun, read_args, mappers, item_filter, shard_dir, \
+        cache_key = args
+    if cache_key is not None and P.isdir(shard_dir):
+        with open(P.join(shard_dir, 'filter_logs.json')) as fp:
+            return [tuple(log) for log in json.load(fp)]
+    out_dir = shard_dir if cache_key is None \
+              else '{}.{}.tmp'.format(shard_dir, os.getpid())
+    os.makedirs(out_dir)
+    inputs = read_fun([filename], *read_args, item_filter=item_filter)
+    transform_rows(inputs, mappers, output_dir=out_dir, write_header=False)
+    logs = item_filter.logs if item_filter is not None else []
+    if cache_key is not None:
+        with open(P.join(out_dir, 'filter_logs.json'), 'w+') as fp:
+            json.dump(logs, fp)
+        os.rename(out_dir, shard_dir)
+    return logs
+
+
+# Increase to invalidate the cached shards written by older versions
+# (version 2: the cached filter logs contain only the file's own entry).
+CACHE_VERSION = 2
+
+
+def conversion_params_hash(read_fun, read_args, mappers, item_filter=None):
+    '''Hash everything except the input file that the output of
+       converting a file depends on: the parameters and the source code
+       of the converter.'''
+    modules = { sys.modules[f.__module__] for f in \
+                [read_fun, transform_rows, elem_content_to_str, ItemFilter,
+                 table_writer] \
+                + [m_func for m_header, m_func in mappers.values()] }
+    h = hashlib.sha256()
+    for filename in sorted(P.abspath(m.__file__) for m in modules):
+        with open(filename, 'rb') as fp:
+            h.update(fp.read())
+    params = [CACHE_VERSION, read_fun.__name__, read_args,
+              [(m_file, m_header, m_func.__name__) \
+               for m_file, (m_header, m_func) in mappers.items()]]
+    if item_filter is not None:
+        params.append((item_filter.max_year, item_filter.min_year,
+                       { attr: [p.pattern for p in patterns] \
+                         for attr, patterns in item_filter.attrs.items() }))
+    h.update(repr(params).encode('utf-8'))
+    return h.hexdigest()
+
+
+def file_cache_key(filename, params_hash):
+    h = hashlib.sha256(params_hash.encode('utf-8'))
+    # the file name appears in the filtering logs
+    h.update(filename.encode('utf-8') + b'\0')
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def convert_files(filenames, read_fun, read_args, mappers, output_dir='.',
+                  item_filter=None, workers=None, cache_dir=None, fmt='csv'):
+    '''Convert the files in a process pool. Each file is converted to
+       partial outputs for all mappers, which are then concatenated in the
+       order of `filenames`, so that the result is the same as from
+       `transform_rows(read_fun(filenames, *read_args), mappers)`.
+
+       If `cache_dir` is given, the partial outputs are kept there, keyed
+       by a hash of the file content and the conversion parameters, and
+       only the files without a cached shard are converted.'''
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        params_hash = conversion_params_hash(
+            read_fun, read_args, mappers, item_filter)
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir, \
+         Pool(workers) as pool:
+        tasks = []
+        for i, filename in enumerate(filenames):
+            shard_dir, cache_key = P.join(tmp_dir, str(i)), None
+            if cache_dir is not None:
+                if not P.isfile(filename):
+                    logging.warning('Skipping "{}": file does not exist'\
+                                    .format(filename))
+                    continue
+                cache_key = file_cache_key(filename, params_hash)
+                shard_dir = P.join(cache_dir, cache_key)
+            # every task gets its own filter, which only collects the
+            # logs of its file
+            tasks.append((filename, read_fun, read_args, mappers,
+                          item_filter.copy() if item_filter is not None \
+                          else None, shard_dir, cache_key))
+        with ExitStack() as stack:
+            if fmt == 'csv':
+                transform_rows([], mappers, output_dir=output_dir)
+                outfiles = { m_file: stack.enter_context(
+                                 open(P.join(output_dir, m_file), 'ab')) \
+                             for m_file in mappers }
+            else:
+                writers = { m_file: stack.enter_context(table_writer(
+                                P.join(output_dir, table_filename(m_file, fmt)),
+                                m_header)) \
+                            for m_file, (m_header, m_func) in mappers.items() }
+            for task, logs in zip(tasks, pool.imap(_convert_file, tasks)):
+                shard_dir, cache_key = task[-2:]
+                for m_file, (m_header, m_func) in mappers.items():
+                    if fmt == 'csv':
+                        with open(P.join(shard_dir, m_file), 'rb') as fp:
+                            shutil.copyfileobj(fp, outfiles[m_file])
+                    else:
+                        # the shards are always CSV
+                        with open(P.join(shard_dir, m_file), newline='') as fp:
+                            writers[m_file].writerows(
+                                csv.DictReader(fp, m_header))
+                if cache_key is None:
+                    shutil.rmtree(shard_dir)
+                if item_filter is not None:
+                    item_filter.logs.extend(logs)
 
 
 def parse_arguments():
@@ -277,6 +425,26 @@ def parse_arguments():
     parser.add_argument(
         '--poem-types-file', metavar='FILE',
         help='The file with mappings between poem IDs and type IDs.')
+    parser.add_argument(
+        '--max-year', type=int, metavar='YEAR',
+        help='Only convert items recorded in or before YEAR.')
+    parser.add_argument(
+        '--min-year', type=int, metavar='YEAR',
+        help='Only convert items recorded in or after YEAR.')
+    parser.add_argument(
+        '--filter-log-dir', metavar='PATH',
+        help='The directory to write the filtering logs to'
+             ' (default: the output directory).')
+    parser.add_argument(
+        '-j', '--workers', type=int, metavar='N', default=1,
+        help='Convert the XML files in N parallel processes (default: 1).')
+    parser.add_argument(
+        '--cache-dir', metavar='PATH',
+        help='Keep the converted tables of each XML file in PATH and'
+             ' reconvert only the files that have changed.')
+    parser.add_argument(
+        '-f', '--format', choices=['csv', 'parquet'], default='csv',
+        help='The format of the output tables (default: csv).')
     return parser.parse_args()
 
 
@@ -284,30 +452,47 @@ if __name__ == '__main__':
     args = parse_arguments()
 
     if args.xml_files:
-        inputs = read_inputs(args.xml_files, args.prefix, args.collection)
-        transform_rows(inputs, mappers, output_dir=args.output_dir)
+        item_filter = None
+        if args.max_year is not None or args.min_year is not None:
+            item_filter = ItemFilter(max_year=args.max_year,
+                                     min_year=args.min_year)
+        if args.workers > 1 or args.cache_dir is not None:
+            convert_files(args.xml_files, read_inputs,
+                          (args.prefix, args.collection), mappers,
+                          output_dir=args.output_dir,
+                          item_filter=item_filter, workers=args.workers,
+                          cache_dir=args.cache_dir, fmt=args.format)
+        else:
+            inputs = read_inputs(args.xml_files, args.prefix, args.collection,
+                                 item_filter=item_filter)
+            transform_rows(inputs, mappers, output_dir=args.output_dir,
+                           fmt=args.format)
+        if item_filter is not None:
+            item_filter.write_logs(args.filter_log_dir or args.output_dir)
 
     if args.places_file is not None:
         inputs = list(read_csv(args.places_file))
         transform_hash(
             inputs,
-            P.join(args.output_dir, 'county_codes.csv'),
+            P.join(args.output_dir,
+                   table_filename('county_codes.csv', args.format)),
             ('place_id', 'county_code'),
             lambda items: map_county_codes(items, args.prefix))
         transform_hash(
             inputs,
-            P.join(args.output_dir, 'places.csv'),
+            P.join(args.output_dir,
+                   table_filename('places.csv', args.format)),
             ('place_id', 'place_name', 'place_type', 'place_parent_id'),
             lambda items: map_places(items, args.prefix))
 
     if args.xml_types_file is not None:
         types = read_skvr_xml_types(args.xml_types_file)
-        with open(P.join(args.output_dir, 'xmltypes.csv'), 'w+') as fp:
-            fieldnames = ('type_id', 'type_name', 'type_description',
-                          'type_parent_id', 'type_old_names',
-                          'type_comparison', 'type_ref')
-            writer = csv.DictWriter(fp, fieldnames)
-            writer.writeheader()
+        outfile = P.join(args.output_dir,
+                         table_filename('xmltypes.csv', args.format))
+        fieldnames = ('type_id', 'type_name', 'type_description',
+                      'type_parent_id', 'type_old_names',
+                      'type_comparison', 'type_ref')
+        with table_writer(outfile, fieldnames) as writer:
             writer.writerows(types)
 
     if args.json_types_file is not None:
@@ -315,18 +500,18 @@ if __name__ == '__main__':
         with open(args.json_types_file) as fp:
             tree = json.load(fp)
         types = process_skvr_typetree(tree, args.prefix)
-        with open(P.join(args.output_dir, 'types.csv'), 'w+') as fp:
-            fieldnames = ('type_id', 'type_name', 'type_description',
-                          'type_parent_id', 'type_comparison')
-            writer = csv.DictWriter(fp, fieldnames)
-            writer.writeheader()
+        outfile = P.join(args.output_dir,
+                         table_filename('types.csv', args.format))
+        fieldnames = ('type_id', 'type_name', 'type_description',
+                      'type_parent_id', 'type_comparison')
+        with table_writer(outfile, fieldnames) as writer:
             writer.writerows(types)
 
     if args.poem_types_file is not None:
         poem_types = read_skvr_poem_types(args.poem_types_file, args.prefix)
-        with open(P.join(args.output_dir, 'poem_types.csv'), 'w+') as fp:
-            fieldnames = ('poem_id', 'type_id', 'type_is_minor')
-            writer = csv.DictWriter(fp, fieldnames)
-            writer.writeheader()
+        outfile = P.join(args.output_dir,
+                         table_filename('poem_types.csv', args.format))
+        fieldnames = ('poem_id', 'type_id', 'type_is_minor')
+        with table_writer(outfile, fieldnames) as writer:
             writer.writerows(poem_types)
 
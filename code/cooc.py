@@ -1,11 +1,19 @@
 import argparse
+from collections import Counter
 import csv
+import io
+import itertools
 import math
+from multiprocessing import Pool
 import numpy as np
-from scipy.sparse import dok_matrix
+from scipy.sparse import coo_matrix, csr_matrix
+import shutil
 import sys
+import tempfile
 import tqdm
 
+from table_io import table_reader
+
 
 def progress(x, show_progress=False):
     return tqdm.tqdm(x) if show_progress else x
@@ -16,34 +24,207 @@ def _key(d, key_cols):
     return tuple(d[k] for k in key_cols)
 
 
-def read_input(stream):
-    return list(csv.DictReader(stream))
+def _num_pairs(length, window_size):
+    # (an upper bound of) the number of word pairs counted for a unit
+    if window_size == 0 or window_size >= length:
+        return length*length
+    return 2*length*window_size
+
+
+def count_windows(windows, n):
+    '''Count the co-occurrences in the given windows (lists of distinct
+       word ids below `n`). Returns an n x n CSR matrix of pair counts
+       and the vector of word frequencies.'''
+    lengths = np.array([len(w) for w in windows], dtype=np.int64)
+    ids = np.fromiter((i for w in windows for i in w),
+                      dtype=np.int64, count=int(lengths.sum()))
+    # every word is paired with each word of its window (including
+    # itself), so it is repeated as many times as the window is long
+    l = np.repeat(lengths, lengths)
+    starts = np.repeat(np.cumsum(lengths)-lengths, lengths)
+    rows = np.repeat(ids, l)
+    pair_starts = np.cumsum(l)-l
+    cols = ids[np.repeat(starts, l) + np.arange(l.sum()) \
+               - np.repeat(pair_starts, l)]
+    mask = rows != cols
+    rows, cols = rows[mask], cols[mask]
+    m = coo_matrix((np.ones(rows.shape[0], dtype=np.uint32), (rows, cols)),
+                   shape=(n, n)).tocsr()
+    return m, np.bincount(ids, minlength=n).astype(np.float64)
+
+
+def slide_window(ids, window_size, pairs, runs):
+    '''Slide a window of `window_size` words over `ids`, one position at
+       a time. Instead of listing the words of every window, only the
+       changes are tracked: for each run of k consecutive windows in
+       which the words a < b both occur, (a, b, k) is appended to
+       `pairs`, and for each run of k windows containing a, (a, k) is
+       appended to `runs`. Negative ids (pruned words) take up positions
+       in the window, but are not counted. Returns the number of
+       windows.'''
+    counts = {}         # word => number of occurrences in the window
+    present = {}        # word => the window in which its run started
+    pair_starts = {}    # (a, b) => the window in which their run started
+    num_windows = len(ids)-window_size+1
+    for i, w in enumerate(ids):
+        # j is the first window containing position i
+        j = max(i-window_size+1, 0)
+        if j > 0:
+            # `w` enters and `old` leaves the window
+            old = ids[i-window_size]
+            if old == w:
+                continue
+            if old >= 0:
+                counts[old] -= 1
+                if counts[old] == 0:
+                    del counts[old]
+                    runs.append((old, j-present.pop(old)))
+                    for x in present:
+                        key = (old, x) if old < x else (x, old)
+                        pairs.append(key + (j-pair_starts.pop(key),))
+        if w < 0:
+            continue
+        c = counts.get(w, 0)
+        counts[w] = c+1
+        if c == 0:
+            for x in present:
+                pair_starts[(w, x) if w < x else (x, w)] = j
+            present[w] = j
+    for w, i in present.items():
+        runs.append((w, num_windows-i))
+    for key, i in pair_starts.items():
+        pairs.append(key + (num_windows-i,))
+    return num_windows
+
+
+def count_units(units, window_size, n):
+    '''Count the co-occurrences in text units (lists of word ids below
+       `n`, negative ids are skipped). Returns the matrix of pair counts, the vector of word
+       frequencies and the number of windows.'''
+    windows, pairs, runs, total = [], [], [], 0
+    for ids in units:
+        if window_size == 0 or window_size >= len(ids):
+            windows.append([i for i in set(ids) if i >= 0])
+            total += 1
+        else:
+            total += slide_window(ids, window_size, pairs, runs)
+    m, freqs = count_windows(windows, n)
+    if pairs:
+        a, b, k = np.array(pairs, dtype=np.int64).T
+        m += coo_matrix((np.concatenate((k, k)).astype(np.uint32),
+                         (np.concatenate((a, b)), np.concatenate((b, a)))),
+                        shape=(n, n)).tocsr()
+    if runs:
+        w, k = np.array(runs, dtype=np.int64).T
+        freqs += np.bincount(w, weights=k, minlength=n)
+    return m, freqs, total
+
+
+def _count_units(args):
+    # worker function
+    return count_units(*args)
 
 
 class CoocCounter:
-    def __init__(self, vocab, window_size=0):
-        self.vocab = vocab
+    '''Counts in how many windows each pair of words co-occurs. The
+       text units are collected in batches and the pairs of each batch
+       are generated as NumPy arrays and summed into a sparse matrix.
+       Words not in the initial `vocab` get new ids as they are
+       encountered, or, if `fixed_vocab` is set, are left out of the
+       counts (but still occupy their positions in the windows).'''
+
+    def __init__(self, vocab=(), window_size=0, batch_size=1000000,
+                 fixed_vocab=False):
+        self.vocab = list(vocab)
         self.window_size = window_size
+        self.batch_size = batch_size
+        self.fixed_vocab = fixed_vocab
         self.word_ids = { word: i for i, word in enumerate(vocab) }
-        self.m = dok_matrix((len(vocab), len(vocab)), dtype=np.uint32)
+        self._m = csr_matrix((len(vocab), len(vocab)), dtype=np.uint32)
         self.freqs = np.zeros(len(vocab))
         self.total = 0
+        # the units and single windows (lists of word ids) not counted yet
+        self._units = []
+        self._windows = []
+        self._num_pairs = 0
+
+    @property
+    def m(self):
+        self.flush()
+        return self._m
 
     def add(self, words):
-        if self.window_size == 0 or self.window_size >= len(words):
-            self.add_window(words)
-        else:
-            for i in range(len(words)-self.window_size):
-                self.add_window(words[i:i+self.window_size])
+        ids = [self._word_id(w) for w in words]
+        self._units.append(ids)
+        self._num_pairs += _num_pairs(len(ids), self.window_size)
+        if self._num_pairs >= self.batch_size:
+            self.flush()
 
     def add_window(self, words):
-        words_s = set(words)
-        for w1 in words_s:
-            for w2 in words_s:
-                if w1 != w2:
-                    self.m[self.word_ids[w1],self.word_ids[w2]] += 1
-            self.freqs[self.word_ids[w1]] += 1
-        self.total += 1
+        ids = [i for i in set(self._word_id(w) for w in words) if i >= 0]
+        self._windows.append(ids)
+        self._num_pairs += _num_pairs(len(ids), 0)
+        if self._num_pairs >= self.batch_size:
+            self.flush()
+
+    def add_parallel(self, texts, workers):
+        '''Count the co-occurrences in `texts` (lists of words) using
+           a pool of processes. The words are converted to ids here and
+           the batches of texts are counted in the workers.'''
+
+        def batches():
+            units, num_pairs = [], 0
+            for words in texts:
+                ids = [self._word_id(w) for w in words]
+                units.append(ids)
+                num_pairs += _num_pairs(len(ids), self.window_size)
+                if num_pairs >= self.batch_size:
+                    yield units, self.window_size, len(self.vocab)
+                    units, num_pairs = [], 0
+            if units:
+                yield units, self.window_size, len(self.vocab)
+
+        self.flush()
+        args = batches()
+        with Pool(workers) as pool:
+            while True:
+                # a few batches per process at a time to bound memory
+                batch = list(itertools.islice(args, 2*workers))
+                if not batch:
+                    break
+                for m, freqs, total in pool.map(_count_units, batch):
+                    self._add_counts(m, freqs, total)
+
+    def _word_id(self, word):
+        i = self.word_ids.get(word)
+        if i is None:
+            if self.fixed_vocab:
+                return -1
+            i = self.word_ids[word] = len(self.vocab)
+            self.vocab.append(word)
+        return i
+
+    def _add_counts(self, m, freqs, total):
+        n = len(self.vocab)
+        if self._m.shape[0] < n:
+            self._m.resize((n, n))
+            self.freqs = np.concatenate(
+                (self.freqs, np.zeros(n-self.freqs.shape[0])))
+        if m.shape[0] < n:
+            m.resize((n, n))
+            freqs = np.concatenate((freqs, np.zeros(n-freqs.shape[0])))
+        self._m += m
+        self.freqs += freqs
+        self.total += total
+
+    def flush(self):
+        '''Add the pending units and windows to the matrix.'''
+        if self._units:
+            self._add_counts(*count_units(
+                self._units, self.window_size, len(self.vocab)))
+        if self._windows:
+            self._add_counts(*count_units(self._windows, 0, len(self.vocab)))
+        self._units, self._windows, self._num_pairs = [], [], 0
 
     def items(self):
         x, y = self.m.nonzero()
@@ -81,6 +262,48 @@ class CoocCounter:
                - xlogx(n-n_x) - xlogx(n-n_y)
         return 2*logl
 
+    def scores(self):
+        '''Compute the measures for all co-occurring pairs at once.
+           Returns arrays of the row and column ids, frequencies,
+           log-likelihoods, Dice coefficients and mutual information.'''
+        m = self.m.tocoo()
+        x, y = m.row, m.col
+        logl, dice, mutinf = measures(
+            m.data, self.freqs[x], self.freqs[y], self.total)
+        return x, y, m.data, logl, dice, mutinf
+
+    def save(self, filename, columns=('text_1', 'text_2')):
+        '''Save the counts as an uncompressed `.npz` file, which can be
+           memory-mapped by `cooc_query.py`. `columns` are the names of
+           the word columns in the output, to be used also by the queries.'''
+        m = self.m
+        m.sum_duplicates()
+        vocab = np.array(self.vocab, dtype=str)
+        order = np.argsort(vocab, kind='stable')
+        np.savez(filename, vocab=vocab, sorted_vocab=vocab[order],
+                 sorted_ids=order, freqs=self.freqs, total=self.total,
+                 indptr=m.indptr, indices=m.indices, data=m.data,
+                 columns=np.array(columns, dtype=str))
+
+
+def measures(n_xy, n_x, n_y, n):
+    '''Compute the log-likelihood, Dice coefficient and mutual information
+       for arrays of pair counts (`n_xy`), word frequencies (`n_x`, `n_y`)
+       and the total number of windows (`n`).'''
+
+    # x*log(x) for nonnegative integers (with 0*log(0) = 0)
+    def xlogx(x):
+        return x*np.log(np.maximum(x, 1))
+
+    n_xy, n = np.asarray(n_xy, dtype=np.float64), float(n)
+    logl = xlogx(n) - xlogx(n_x) - xlogx(n_y) + xlogx(n_xy) \
+           + xlogx(n-n_x-n_y+n_xy) \
+           + xlogx(n_x-n_xy) + xlogx(n_y-n_xy) \
+           - xlogx(n-n_x) - xlogx(n-n_y)
+    dice = 2*n_xy / (n_x + n_y)
+    mutinf = np.log((n*n_xy)/(n_x*n_y))
+    return 2*logl, dice, mutinf
+
 # Co-occurrence significance measures
 
 #def dice(n_ab, n_a, n_b, n):
@@ -123,45 +346,93 @@ def parse_arguments():
     parser.add_argument(
         '-w', '--window-size', type=int, default=0,
         help='Window size (0=the whole text unit).')
+    parser.add_argument(
+        '--batch-size', type=int, default=1000000,
+        help='The number of word pairs to count at once (default: 1000000).')
+    parser.add_argument(
+        '-j', '--workers', type=int, default=1,
+        help='Number of processes to count the co-occurrences in'
+             ' (default: 1).')
+    parser.add_argument(
+        '--save-model', metavar='FILE',
+        help='Save the counts to a `.npz` file for querying with'
+             ' `cooc_query.py`.')
+    parser.add_argument(
+        '--min-freq', type=int, default=1,
+        help='Leave out words occurring less than this many times'
+             ' (requires an additional pass over the input).')
+    parser.add_argument(
+        '--top-k', type=int, default=0,
+        help='Output only the K pairs with the highest log-likelihood'
+             ' for each word (0=all pairs above the threshold).')
     return parser.parse_args()
 
 
+def read_texts(stream, key_cols, word_col, show_progress=False):
+    # the input is grouped by text units, so the words of a unit are
+    # yielded as soon as the next one starts
+    with table_reader(stream) as reader:
+        units = itertools.groupby(progress(reader, show_progress),
+                                  key=lambda d: _key(d, key_cols))
+        for key, rows in units:
+            yield [d[word_col] for d in rows]
+
+
+def word_frequencies(stream, word_col):
+    with table_reader(stream) as reader:
+        return Counter(d[word_col] for d in reader)
+
+
+def top_k(x, scores, k):
+    '''Return the indices of the `k` highest `scores` for each value of
+       `x`, grouped by `x` and in descending order of the scores.'''
+    order = np.lexsort((-scores, x))
+    x = x[order]
+    # the rank of each score within its group
+    starts = np.flatnonzero(np.r_[True, x[1:] != x[:-1]])
+    sizes = np.diff(np.r_[starts, x.shape[0]])
+    rank = np.arange(x.shape[0]) - np.repeat(starts, sizes)
+    return order[rank < k]
+
+
 def main():
     args = parse_arguments()
     key_cols = args.key.split(',')
-    data = read_input(sys.stdin)
-    words = list(set(d[args.word_col] for d in data))
-    counter = CoocCounter(words, window_size=args.window_size)
-    #word_ids = { word: i for i, word in enumerate(words) }
-    #m = dok_matrix((len(words), len(words)), dtype=np.uint32)
-    #freqs = np.zeros(len(words))
-    #key, words, total = None, [], 0
-    key, cur_words = None, []
-    for d in progress(data, args.show_progress):
-        if _key(d, key_cols) != key:
-            if cur_words:
-                counter.add(cur_words)
-            key, cur_words = _key(d, key_cols), []
-        cur_words.append(d[args.word_col])
-    if cur_words:
-        counter.add(cur_words)
-    writer = csv.DictWriter(
-        sys.stdout, lineterminator='\n',
-        fieldnames=(args.word_col+'_1', args.word_col+'_2',
-                    'freq', 'logl', 'dice', 'mutinf'))
-    writer.writeheader()
-    for x, y in progress(counter.items(), args.show_progress):
-        ll = counter.logl(x, y)
-        if ll > args.threshold:
-            writer.writerow({
-                args.word_col+'_1': x,
-                args.word_col+'_2': y,
-                'freq': counter.freq(x, y),
-                'logl': ll,
-                'dice': counter.dice(x, y),
-                'mutinf': counter.mutinf(x, y)
-            })
-
+    stream = sys.stdin
+    if args.min_freq > 1:
+        if not stream.seekable():
+            # spool the input to read it twice
+            spool = tempfile.TemporaryFile()
+            shutil.copyfileobj(stream.buffer, spool)
+            spool.seek(0)
+            stream = io.TextIOWrapper(spool, encoding='utf-8')
+        vocab = [w for w, f in word_frequencies(stream, args.word_col).items() \
+                 if f >= args.min_freq]
+        stream.seek(0)
+        counter = CoocCounter(vocab, window_size=args.window_size,
+                              batch_size=args.batch_size, fixed_vocab=True)
+    else:
+        counter = CoocCounter(window_size=args.window_size,
+                              batch_size=args.batch_size)
+    texts = read_texts(stream, key_cols, args.word_col, args.show_progress)
+    if args.workers > 1:
+        counter.add_parallel(texts, args.workers)
+    else:
+        for words in texts:
+            counter.add(words)
+    columns = (args.word_col+'_1', args.word_col+'_2')
+    if args.save_model is not None:
+        counter.save(args.save_model, columns)
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(columns + ('freq', 'logl', 'dice', 'mutinf'))
+    x, y, freq, logl, dice, mutinf = counter.scores()
+    idx = np.flatnonzero(logl > args.threshold)
+    if args.top_k > 0:
+        idx = idx[top_k(x[idx], logl[idx], args.top_k)]
+    vocab = np.array(counter.vocab, dtype=object)
+    writer.writerows(zip(vocab[x[idx]], vocab[y[idx]],
+                         freq[idx].tolist(), logl[idx].tolist(),
+                         dice[idx].tolist(), mutinf[idx].tolist()))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,122 @@
+'''Query a co-occurrence model saved with `cooc.py --save-model`.
+
+The members of the (uncompressed) `.npz` file are memory-mapped, so
+loading the model is instantaneous and a query only reads the row of the
+count matrix belonging to the queried word.'''
+
+import argparse
+import csv
+import logging
+import struct
+import sys
+import zipfile
+
+import numpy as np
+
+from cooc import measures
+
+
+MEASURES = ('logl', 'dice', 'mutinf')
+
+
+def mmap_npz(filename):
+    '''Memory-map the arrays stored in an uncompressed `.npz` file.
+       Returns a dict of arrays (scalars are read into memory).'''
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf, open(filename, 'rb') as fp:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('{}: compressed members cannot be'
+                                 ' memory-mapped'.format(filename))
+            # skip the local file header to get to the .npy data
+            fp.seek(info.header_offset)
+            name_len, extra_len = struct.unpack('<HH', fp.read(30)[26:30])
+            fp.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(fp)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(fp)
+            else:
+                header = np.lib.format.read_array_header_2_0(fp)
+            shape, fortran_order, dtype = header
+            name = info.filename[:-4] if info.filename.endswith('.npy') \
+                   else info.filename
+            if shape == ():
+                arrays[name] = np.frombuffer(fp.read(dtype.itemsize), dtype)[0]
+            else:
+                arrays[name] = np.memmap(
+                    filename, dtype=dtype, mode='r', offset=fp.tell(),
+                    shape=shape, order='F' if fortran_order else 'C')
+    return arrays
+
+
+class CoocModel:
+    def __init__(self, filename):
+        arrays = mmap_npz(filename)
+        self.vocab = arrays['vocab']
+        self.sorted_vocab = arrays['sorted_vocab']
+        self.sorted_ids = arrays['sorted_ids']
+        self.freqs = arrays['freqs']
+        self.total = arrays['total']
+        self.indptr = arrays['indptr']
+        self.indices = arrays['indices']
+        self.data = arrays['data']
+        # the names of the word columns (not saved by older versions)
+        self.columns = tuple(str(c) for c in arrays['columns']) \
+                       if 'columns' in arrays else ('text_1', 'text_2')
+
+    def word_id(self, word):
+        i = np.searchsorted(self.sorted_vocab, word)
+        if i < self.sorted_vocab.shape[0] and self.sorted_vocab[i] == word:
+            return int(self.sorted_ids[i])
+        raise KeyError(word)
+
+    def collocates(self, word, k=10, measure='logl'):
+        '''Return the `k` words co-occurring with `word` that score the
+           highest on `measure`, as tuples (word, freq, logl, dice,
+           mutinf).'''
+        i = self.word_id(word)
+        start, end = self.indptr[i], self.indptr[i+1]
+        cols = np.asarray(self.indices[start:end])
+        n_xy = np.asarray(self.data[start:end])
+        scores = dict(zip(MEASURES, measures(
+            n_xy, self.freqs[i], np.asarray(self.freqs[cols]), self.total)))
+        top = np.argsort(-scores[measure], kind='stable')[:k]
+        return [(str(self.vocab[cols[j]]), int(n_xy[j])) \
+                + tuple(float(scores[m][j]) for m in MEASURES) \
+                for j in top]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Find the strongest collocates of words in a saved'
+                    ' co-occurrence model.')
+    parser.add_argument(
+        '-m', '--model', metavar='FILE', required=True,
+        help='The model file saved with `cooc.py --save-model`.')
+    parser.add_argument(
+        '-k', '--top-k', type=int, default=10,
+        help='The number of collocates to return for each word'
+             ' (default: 10).')
+    parser.add_argument(
+        '-s', '--sort-by', choices=MEASURES, default='logl',
+        help='The measure to rank the collocates by (default: logl).')
+    parser.add_argument('words', nargs='+', metavar='WORD',
+                        help='The words to query.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    model = CoocModel(args.model)
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(model.columns + ('freq',) + MEASURES)
+    for word in args.words:
+        try:
+            for row in model.collocates(word, args.top_k, args.sort_by):
+                writer.writerow((word,) + row)
+        except KeyError:
+            logging.warning('word not found: {}'.format(word))
+
+
+if __name__ == '__main__':
+    main()
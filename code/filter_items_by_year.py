@@ -1,64 +1,428 @@
 # Python Script: filter_items_by_year.py
 import argparse
+import copy
+import glob
+import json
 from lxml import etree
+from multiprocessing import Pool
 import os
+import re
 
-def filter_items_by_year(input_file, output_file, max_year):
-    
-    output_dir = os.path.dirname(output_file)
-    os.makedirs(output_dir, exist_ok=True)
 
-    exceptions_log_path = os.path.join(output_dir, "filtering_exceptions.log")
-    summary_log_path = os.path.join(output_dir, "filtering.log")
+def check_year(item, input_file, max_year, min_year=None):
+    """Decide whether to keep an <ITEM>. Returns a pair (keep, message),
+    where message is a line for the exceptions log or None."""
+    year = item.get("y")
+    if year is not None:
+        year = year.strip()  # Remove extra whitespace
+        if year.isdigit():
+            year = int(year)
+            return (min_year is None or year >= min_year) \
+                   and (max_year is None or year <= max_year), None
+        else:
+            return False, f"{input_file}: Invalid year format '{year}' in ITEM {item.get('nro')}\n"
+    else:
+        return False, f"{input_file}: Missing 'y' attribute in ITEM {item.get('nro')}\n"
+
+
+def summary_line(input_file, total_items, included_items):
+    inclusion_percentage = (included_items / total_items * 100) if total_items > 0 else 0
+    return (f"{input_file}: Processed {total_items} items, included {included_items} items, "
+            f"{inclusion_percentage:.2f}% included.\n")
+
+
+def write_logs(log_dir, exceptions, summary):
+    with open(os.path.join(log_dir, "filtering_exceptions.log"), "a", encoding="utf-8") as exceptions_log:
+        exceptions_log.writelines(exceptions)
+    with open(os.path.join(log_dir, "filtering.log"), "a", encoding="utf-8") as summary_log:
+        summary_log.write(summary)
+
+
+def filter_file(input_file, output_file, max_year):
+    """Filter a single file and write the result to output_file.
+    Returns the lines for the exceptions log and the summary log."""
 
     total_items = 0
     included_items = 0
+    exceptions = []
 
-    with open(exceptions_log_path, "a", encoding="utf-8") as exceptions_log:
-        parser = etree.XMLParser(remove_blank_text=True)
-        tree = etree.parse(input_file, parser)
-        root = tree.getroot()
-
-        # Iterate over <ITEM> elements
-        for item in root.xpath(".//ITEM"):
-            total_items += 1
-            year = item.get("y")
-            if year is not None:
-                year = year.strip()  # Remove extra whitespace
-                if year.isdigit():
-                    year = int(year)
-                    if year <= max_year:
-                        included_items += 1
-                        continue  # Keep this <ITEM>
-                else:
-                    exceptions_log.write(f"{input_file}: Invalid year format '{year}' in ITEM {item.get('nro')}\n")
-            else:
-                exceptions_log.write(f"{input_file}: Missing 'y' attribute in ITEM {item.get('nro')}\n")
+    parser = etree.XMLParser(remove_blank_text=True)
+    tree = etree.parse(input_file, parser)
+    root = tree.getroot()
+
+    # Iterate over <ITEM> elements
+    for item in root.xpath(".//ITEM"):
+        total_items += 1
+        keep, message = check_year(item, input_file, max_year)
+        if message is not None:
+            exceptions.append(message)
+        if keep:
+            included_items += 1
+            continue  # Keep this <ITEM>
+
+        # Remove <ITEM> if invalid or exceeds the limit
+        parent = item.getparent()
+        parent.remove(item)
+
+    # Handle case where all <ITEM>s are omitted
+    if included_items == 0:
+        exceptions.append(f"{input_file}: No valid <ITEM> elements remaining after filtering.\n")
+
+    # Save the filtered XML if any items remain
+    if included_items > 0:
+        tree.write(output_file, pretty_print=True, encoding="utf-8", xml_declaration=True)
+
+    return exceptions, summary_line(input_file, total_items, included_items)
+
+
+class ItemFilter:
+    """A filter for <ITEM> elements that is applied while another script
+    (e.g. the converters) reads them, instead of writing filtered copies
+    of the files. Collects the same log lines as filter_items_by_year().
+
+    Besides the year range, a filter can have predicates on the attributes
+    `nro`, `p`, `k` and `y`: a regular expression (or a list of them) that
+    must match the whole value. For attributes with multiple IDs separated
+    by semicolons, it is enough that one of them matches."""
+
+    ATTRIBUTES = ("nro", "p", "k", "y")
+
+    def __init__(self, max_year=None, min_year=None, name=None, attrs=None):
+        self.max_year = max_year
+        self.min_year = min_year
+        self.name = name
+        self.attrs = {}
+        for attr, patterns in (attrs or {}).items():
+            if attr not in self.ATTRIBUTES:
+                raise ValueError(f"Unknown ITEM attribute: {attr}")
+            if isinstance(patterns, str):
+                patterns = [patterns]
+            self.attrs[attr] = [re.compile(p) for p in patterns]
+        self.logs = []  # (exceptions, summary) for every finished file
+        self._reset()
+
+    def copy(self):
+        """Return a filter with the same parameters and no logs, e.g. for
+        processing a file in another process."""
+        result = copy.copy(self)
+        result.logs = []
+        result._reset()
+        return result
+
+    def _reset(self):
+        self.total_items = 0
+        self.included_items = 0
+        self.exceptions = []
+
+    def _match_attrs(self, item):
+        for attr, patterns in self.attrs.items():
+            value = item.get(attr)
+            if value is None or not any(p.fullmatch(v.strip()) for p in patterns
+                                        for v in value.split(";")):
+                return False
+        return True
+
+    def __call__(self, input_file, item, nested=False):
+        """Decide whether to keep item. With `nested`, the items nested in
+        it are also counted and checked for the exceptions log, like in
+        filter_file(), for callers that only see the top-level items."""
+        keep = self._check(input_file, item)
+        if nested:
+            for nested_item in item.iterdescendants("ITEM"):
+                self._check(input_file, nested_item)
+        return keep
+
+    def _check(self, input_file, item):
+        self.total_items += 1
+        keep = True
+        if self.max_year is not None or self.min_year is not None:
+            keep, message = check_year(item, input_file, self.max_year, self.min_year)
+            if message is not None:
+                self.exceptions.append(message)
+        keep = keep and self._match_attrs(item)
+        if keep:
+            self.included_items += 1
+        return keep
+
+    def finish_file(self, input_file):
+        if self.included_items == 0:
+            self.exceptions.append(f"{input_file}: No valid <ITEM> elements remaining after filtering.\n")
+        self.logs.append((self.exceptions, summary_line(input_file, self.total_items, self.included_items)))
+        self._reset()
+
+    def write_logs(self, log_dir):
+        """Write the logs of all finished files, replacing the logs of
+        a previous run."""
+        os.makedirs(log_dir, exist_ok=True)
+        with open(os.path.join(log_dir, "filtering_exceptions.log"), "w", encoding="utf-8") as exceptions_log, \
+                open(os.path.join(log_dir, "filtering.log"), "w", encoding="utf-8") as summary_log:
+            for exceptions, summary in self.logs:
+                exceptions_log.writelines(exceptions)
+                summary_log.write(summary)
+        self.logs = []
+
+
+def read_subsets(filename):
+    """Read subset definitions from a JSON file of the form:
+    { "name": { "min_year": 1830, "max_year": 1839, "k": "skvr_77" }, ... }
+    Returns a list of ItemFilter objects."""
+    with open(filename, encoding="utf-8") as fp:
+        definitions = json.load(fp)
+    subsets = []
+    for name, definition in definitions.items():
+        definition = dict(definition)
+        min_year = definition.pop("min_year", None)
+        max_year = definition.pop("max_year", None)
+        subsets.append(ItemFilter(max_year=max_year, min_year=min_year,
+                                  name=name, attrs=definition))
+    return subsets
+
+
+def _root_tags(root):
+    """Serialize the start and end tag of the root element, and the
+    element as empty."""
+    wrapper = etree.Element(root.tag, root.attrib, nsmap=root.nsmap)
+    empty = etree.tostring(wrapper, encoding="utf-8")
+    wrapper.text = "x"
+    text = etree.tostring(wrapper, encoding="utf-8")
+    i = text.rindex(b">x</")
+    return text[:i+1], text[i+2:], empty
 
-            # Remove <ITEM> if invalid or exceeds the limit
-            parent = item.getparent()
-            parent.remove(item)
 
-        # Handle case where all <ITEM>s are omitted
-        if included_items == 0:
-            exceptions_log.write(f"{input_file}: No valid <ITEM> elements remaining after filtering.\n")
+def _prolog(root):
+    """Serialize what tree.write() outputs before the root element."""
+    result = b"<?xml version='1.0' encoding='UTF-8'?>\n"
+    doctype = root.getroottree().docinfo.doctype
+    if doctype:
+        result += doctype.encode("utf-8") + b"\n"
+    for node in reversed(list(root.itersiblings(preceding=True))):
+        result += etree.tostring(node, encoding="utf-8") + b"\n"
+    return result
 
+
+def _serialize_children(root, nodes):
+    # Serializing the children inside a copy of the root element gives
+    # exactly the same indentation as pretty-printing the whole document.
+    if not nodes:
+        return b""
+    wrapper = etree.Element(root.tag, root.attrib, nsmap=root.nsmap)
+    for node in nodes:
+        wrapper.append(node)
+    text = etree.tostring(wrapper, pretty_print=True, encoding="utf-8")
+    # Skip the start tag, and the line break after it unless the children
+    # have text between them and are not indented.
+    start = text.index(b">") + 1
+    if text[start:start+1] == b"\n":
+        start += 1
+    return text[start:text.rindex(b"</")]
+
+
+def _flush_children(root, n_outputs, decisions, last=None):
+    """Remove the children of root up to (and including) last and return
+    their serializations for each of the outputs. If last is None, remove
+    all children. `decisions` contains for the items among these children,
+    and nested deeper in them, a list of flags: whether to write them to
+    the respective output."""
+    nodes = []
+    for node in root:
+        nodes.append(node)
+        if node is last:
+            break
+    if not nodes:
+        return [b""] * n_outputs
+    items = [node for node in nodes if node in decisions]
+    nested = [item for node in nodes if isinstance(node.tag, str)
+              for item in node.iter("ITEM") if item is not node and item in decisions]
+    # Outputs with the same decisions get the same text, which is only
+    # serialized once.
+    texts = {}
+    result = []
+    for i in range(n_outputs):
+        key = tuple(decisions[item][i] for item in items + nested)
+        if key not in texts:
+            # Temporarily remove the rejected nested items.
+            removed = [(item.getparent(), item.getparent().index(item), item)
+                       for item in nested if not decisions[item][i]]
+            for parent, index, item in reversed(removed):
+                parent.remove(item)
+            texts[key] = _serialize_children(
+                root, [node for node in nodes if node not in decisions or decisions[node][i]])
+            for parent, index, item in removed:
+                parent.insert(index, item)
+        result.append(texts[key])
+    # Free the items that were not written to any output.
+    for node in nodes:
+        if node.getparent() is root:
+            root.remove(node)
+    for item in items + nested:
+        del decisions[item]
+    return result
+
+
+def filter_file_subsets(input_file, outputs):
+    """Route the <ITEM>s of input_file to multiple outputs in a single parse.
+    `outputs` is a list of (item_filter, output_file) and each item is written
+    to every output whose filter accepts it. The input is parsed incrementally
+    and each item is freed as soon as it is written, so that the memory usage
+    does not depend on the file size. Returns a list of (exceptions, summary)
+    log lines, one for each output."""
+
+    def write(texts):
+        # The start tag is written before the first child, so that the
+        # root can still be written as an empty element if nothing is kept.
+        for out, text in zip(outs, texts):
+            if text:
+                if out.tell() == 0:
+                    out.write(prolog + start_tag + b"\n")
+                out.write(text)
+
+    root = None
+    decisions = {}
+    outs = [open(output_file + ".part", "wb") for item_filter, output_file in outputs]
+    try:
+        for event, item in etree.iterparse(input_file, events=("start", "end"), tag="ITEM",
+                                           remove_blank_text=True):
+            if root is None:
+                root = item.getroottree().getroot()
+                prolog = _prolog(root)
+                start_tag, end_tag, empty = _root_tags(root)
+            if item is root:
+                continue  # Only descendants of the root are filtered
+            if event == "start":
+                # The attributes are already available, and deciding here
+                # keeps the logs in document order.
+                decisions[item] = [item_filter(input_file, item)
+                                   for item_filter, output_file in outputs]
+            elif item.getparent() is root and item.getprevious() is not None:
+                # Items nested deeper are written together with their
+                # top-level ancestor. The current item is kept until the
+                # next one, because the parser may still append text to it.
+                write(_flush_children(root, len(outs), decisions, item.getprevious()))
+        if root is not None:
+            write(_flush_children(root, len(outs), decisions))
+            epilog = b"".join(etree.tostring(node, encoding="utf-8") + b"\n"
+                              for node in root.itersiblings())
+            for out in outs:
+                if out.tell() == 0:
+                    out.write(prolog + empty + b"\n" + epilog)
+                else:
+                    out.write(end_tag + b"\n" + epilog)
+    finally:
+        for out in outs:
+            out.close()
+
+    logs = []
+    for item_filter, output_file in outputs:
         # Save the filtered XML if any items remain
-        if included_items > 0:
-            tree.write(output_file, pretty_print=True, encoding="utf-8", xml_declaration=True)
+        if item_filter.included_items > 0:
+            os.replace(output_file + ".part", output_file)
+        else:
+            os.remove(output_file + ".part")
+        item_filter.finish_file(input_file)
+        logs.append(item_filter.logs.pop())
+    return logs
 
-    # Write summary log
-    inclusion_percentage = (included_items / total_items * 100) if total_items > 0 else 0
-    with open(summary_log_path, "a", encoding="utf-8") as summary_log:
-        summary_log.write(f"{input_file}: Processed {total_items} items, included {included_items} items, "
-                          f"{inclusion_percentage:.2f}% included.\n")
+
+def filter_file_streaming(input_file, output_file, max_year):
+    """The same as filter_file(), but parses the input incrementally and
+    writes each kept <ITEM> as soon as it is processed, so that only one
+    item at a time is kept in memory. The output is byte-identical, unless
+    the root element contains text between its children (which is kept,
+    but indented differently)."""
+
+    return filter_file_subsets(input_file, [(ItemFilter(max_year=max_year), output_file)])[0]
+
+
+def filter_items_by_year(input_file, output_file, max_year, streaming=False):
+
+    output_dir = os.path.dirname(output_file)
+    os.makedirs(output_dir, exist_ok=True)
+
+    filter_func = filter_file_streaming if streaming else filter_file
+    exceptions, summary = filter_func(input_file, output_file, max_year)
+    write_logs(output_dir, exceptions, summary)
+
+
+def _filter_file_args(args):
+    streaming, args = args[0], args[1:]
+    return (filter_file_streaming if streaming else filter_file)(*args)
+
+
+def filter_files_by_year(input_files, output_dir, max_year, workers=None, streaming=False):
+    """Filter many files in parallel, writing the outputs to output_dir
+    under the same basenames. The logs are written in the order of
+    input_files, so that they are the same as from sequential calls
+    of filter_items_by_year()."""
+
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(streaming, input_file, os.path.join(output_dir, os.path.basename(input_file)), max_year)
+             for input_file in input_files]
+    with Pool(workers) as pool:
+        for exceptions, summary in pool.imap(_filter_file_args, tasks):
+            write_logs(output_dir, exceptions, summary)
+
+
+def _filter_subsets_args(args):
+    input_file, output_dir, subsets = args
+    basename = os.path.basename(input_file)
+    return filter_file_subsets(
+        input_file, [(subset, os.path.join(output_dir, subset.name, basename)) for subset in subsets])
+
+
+def filter_files_by_subsets(input_files, output_dir, subsets, workers=None):
+    """Extract multiple subsets (see read_subsets()) in a single pass over
+    the files. Each subset is written to its own subdirectory of output_dir,
+    together with its logs."""
+
+    for subset in subsets:
+        os.makedirs(os.path.join(output_dir, subset.name), exist_ok=True)
+    tasks = [(input_file, output_dir, subsets) for input_file in input_files]
+    with Pool(workers) as pool:
+        for logs in pool.imap(_filter_subsets_args, tasks):
+            for subset, (exceptions, summary) in zip(subsets, logs):
+                write_logs(os.path.join(output_dir, subset.name), exceptions, summary)
+
+
+def expand_inputs(patterns):
+    """Expand glob patterns that are not names of existing files."""
+    result = []
+    for pattern in patterns:
+        if os.path.isfile(pattern):
+            result.append(pattern)
+        else:
+            result.extend(sorted(glob.glob(pattern)))
+    return result
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Filter XML items by year.")
-    parser.add_argument("input_file", help="Path to the input XML file.")
-    parser.add_argument("output_file", help="Path to the output XML file.")
-    parser.add_argument("--max-year", type=int, required=True, help="Maximum year to retain in <ITEM> elements.")
+    parser = argparse.ArgumentParser(
+        description="Filter XML items by year. Without --output-dir, the arguments "
+                    "are a single input and output file. With --output-dir, all "
+                    "arguments are input files (or glob patterns).")
+    parser.add_argument("files", nargs="+", metavar="FILE", help="Input (and output) XML files.")
+    parser.add_argument("--max-year", type=int, help="Maximum year to retain in <ITEM> elements.")
+    parser.add_argument("-d", "--output-dir", help="Directory to write the filtered files to (batch mode).")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of worker processes in batch mode (default: number of CPUs).")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Parse the input incrementally to keep memory usage bounded.")
+    parser.add_argument("--subsets", metavar="FILE",
+                        help="JSON file with named subset definitions to extract in a single pass "
+                             "(each to a subdirectory of --output-dir) instead of --max-year.")
 
     args = parser.parse_args()
-    filter_items_by_year(args.input_file, args.output_file, args.max_year)
+    if args.subsets is not None:
+        if args.output_dir is None:
+            parser.error("--subsets requires --output-dir")
+        filter_files_by_subsets(expand_inputs(args.files), args.output_dir, read_subsets(args.subsets),
+                                workers=args.workers)
+    elif args.max_year is None:
+        parser.error("either --max-year or --subsets is required")
+    elif args.output_dir is not None:
+        filter_files_by_year(expand_inputs(args.files), args.output_dir, args.max_year,
+                             workers=args.workers, streaming=args.streaming)
+    elif len(args.files) == 2:
+        filter_items_by_year(args.files[0], args.files[1], args.max_year,
+                             streaming=args.streaming)
+    else:
+        parser.error("expected an input and an output file, or --output-dir")
@@ -0,0 +1,207 @@
+import argparse
+import csv
+import logging
+import mmap
+import re
+import sys
+
+from lxml import etree
+
+
+FIELDS = ('file', 'start', 'end', 'nro', 'p', 'k', 'y', 'teos')
+ATTRIBUTES = ('nro', 'p', 'k', 'y')
+
+TAG_PATTERN = re.compile(rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<(/?)ITEM(\s[^>]*?)?(/?)>',
+                         flags=re.DOTALL)
+ATTR_PATTERN = re.compile(rb'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+TEOS_PATTERN = re.compile(rb'<TEOS(?:\s[^>]*)?>(.*?)</TEOS>', flags=re.DOTALL)
+REF_PATTERN = re.compile(r'&(?:#x([0-9a-fA-F]+)|#([0-9]+)|(lt|gt|amp|quot|apos));')
+ENTITIES = { 'lt': '<', 'gt': '>', 'amp': '&', 'quot': '"', 'apos': '\'' }
+
+
+def _replace_ref(m):
+    if m.group(1):
+        return chr(int(m.group(1), 16))
+    if m.group(2):
+        return chr(int(m.group(2)))
+    return ENTITIES[m.group(3)]
+
+
+def _decode(value, attr=False):
+    '''Replace the character and entity references like an XML parser.
+       In attribute values, literal line breaks and tabs are also
+       normalized to spaces (but not the ones given as references).'''
+    value = value.decode('utf-8')
+    if attr:
+        value = re.sub(r'\r\n|[\t\n\r]', ' ', value)
+    return REF_PATTERN.sub(_replace_ref, value)
+
+
+def scan_file(filename):
+    '''Find all ITEMs in an XML file without parsing it. Yields a dict
+       with the byte range [start, end) and the key attributes of each
+       ITEM, in document order (i.e. the order of the opening tags).
+       Nested ITEMs get their own entries, which follow the entry of
+       the enclosing ITEM.'''
+    with open(filename, 'rb') as fp:
+        try:
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+        with data:
+            # the open ITEMs as indices to `entries`, which holds the
+            # entries of the outermost open ITEM until it is closed
+            stack, entries = [], []
+            for m in TAG_PATTERN.finditer(data):
+                if m.group(0).startswith(b'<!'):
+                    continue
+                if m.group(1):
+                    if not stack:
+                        logging.warning('{}: unmatched </ITEM> at byte {}'\
+                                        .format(filename, m.start()))
+                        continue
+                    i = stack.pop()
+                    start, attrs = entries[i]
+                    entries[i] = _entry(filename, data, start, m.end(), attrs)
+                elif m.group(3):
+                    entries.append(_entry(filename, data, m.start(), m.end(),
+                                          m.group(2) or b''))
+                else:
+                    stack.append(len(entries))
+                    entries.append((m.start(), m.group(2) or b''))
+                if not stack:
+                    yield from entries
+                    entries = []
+            if stack:
+                logging.warning('{}: {} unclosed <ITEM> tags'\
+                                .format(filename, len(stack)))
+                yield from (e for e in entries if isinstance(e, dict))
+
+
+def _entry(filename, data, start, end, attrs):
+    attrs = { m.group(1).decode('utf-8'): _decode(m.group(2) or m.group(3) or b'', attr=True) \
+              for m in ATTR_PATTERN.finditer(attrs) }
+    teos = TEOS_PATTERN.search(data, start, end)
+    entry = { 'file': filename, 'start': start, 'end': end }
+    for a in ATTRIBUTES:
+        entry[a] = attrs.get(a, '')
+    entry['teos'] = _decode(teos.group(1)).strip() if teos is not None else ''
+    return entry
+
+
+def build_index(filenames):
+    for filename in filenames:
+        yield from scan_file(filename)
+
+
+def write_index(entries, filename):
+    with open(filename, 'w+') as fp:
+        writer = csv.DictWriter(fp, FIELDS)
+        writer.writeheader()
+        writer.writerows(entries)
+
+
+def read_index(filename):
+    with open(filename) as fp:
+        for row in csv.DictReader(fp):
+            row['start'], row['end'] = int(row['start']), int(row['end'])
+            yield row
+
+
+def select(entries, ids=None, **patterns):
+    '''Select index entries by poem id and/or metadata. `ids` is a
+       collection of `nro` values, the keyword arguments map fields
+       (`nro`, `p`, `k`, `y`, `teos`, `file`) to regular expressions
+       that must match the whole value.'''
+    ids = set(ids) if ids is not None else None
+    patterns = { key: re.compile(value) for key, value in patterns.items() \
+                 if value is not None }
+    for entry in entries:
+        if ids is not None and entry['nro'] not in ids:
+            continue
+        if all(p.fullmatch(entry[key]) for key, p in patterns.items()):
+            yield entry
+
+
+def extract(entries):
+    '''Yield the raw bytes of the given items. Entries from the same
+       file are read through a single open file handle.'''
+    fp, cur_file = None, None
+    try:
+        for entry in entries:
+            if entry['file'] != cur_file:
+                if fp is not None:
+                    fp.close()
+                fp, cur_file = open(entry['file'], 'rb'), entry['file']
+            fp.seek(entry['start'])
+            yield fp.read(entry['end']-entry['start'])
+    finally:
+        if fp is not None:
+            fp.close()
+
+
+def parse_items(entries):
+    '''Parse the given items into lxml elements.'''
+    for data in extract(entries):
+        yield etree.fromstring(data)
+
+
+def write_items(entries, fp, root='root'):
+    '''Write the given items verbatim into an XML document.'''
+    fp.write(b'<?xml version=\'1.0\' encoding=\'UTF-8\'?>\n')
+    fp.write('<{}>\n'.format(root).encode('utf-8'))
+    for data in extract(entries):
+        fp.write(data)
+        fp.write(b'\n')
+    fp.write('</{}>\n'.format(root).encode('utf-8'))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Index the ITEMs of raw XML files by byte offset and'
+                    ' extract selected ITEMs without parsing whole files.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser(
+        'build', help='Build the index of ITEMs in the given files.')
+    build_parser.add_argument(
+        '-o', '--index-file', metavar='FILE', required=True,
+        help='File to write the index to (CSV).')
+    build_parser.add_argument('files', nargs='+', metavar='FILE',
+                              help='Input XML files.')
+    extract_parser = subparsers.add_parser(
+        'extract', help='Extract ITEMs by poem id and/or metadata.')
+    extract_parser.add_argument(
+        '-I', '--index-file', metavar='FILE', required=True,
+        help='The index file created with `build`.')
+    extract_parser.add_argument(
+        '-o', '--output-file', metavar='FILE',
+        help='Output XML file (default: stdout).')
+    extract_parser.add_argument(
+        'ids', nargs='*', metavar='NRO',
+        help='Poem ids (`nro` attributes) of the ITEMs to extract.')
+    for field in ('nro', 'p', 'k', 'y', 'teos'):
+        extract_parser.add_argument(
+            '--{}'.format(field), metavar='REGEX',
+            help='Regular expression for the `{}` field.'.format(field))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.command == 'build':
+        write_index(build_index(args.files), args.index_file)
+    elif args.command == 'extract':
+        entries = select(read_index(args.index_file),
+                         ids=args.ids if args.ids else None,
+                         nro=args.nro, p=args.p, k=args.k, y=args.y,
+                         teos=args.teos)
+        if args.output_file is not None:
+            with open(args.output_file, 'wb') as fp:
+                write_items(entries, fp)
+        else:
+            write_items(entries, sys.stdout.buffer)
+
+
+if __name__ == '__main__':
+    main()
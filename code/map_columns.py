@@ -4,11 +4,12 @@ from operator import itemgetter
 import os.path
 import sys
 
+from table_io import table_reader
+
 
 def load_mapping(filename, cols_from, cols_to):
     mapping = {}
-    with open(filename) as fp:
-        reader = csv.DictReader(fp)
+    with table_reader(filename) as reader:
         for row in reader:
             key = tuple(row[c] for c in cols_from)
             val = tuple(row[c] for c in cols_to)
@@ -30,6 +31,75 @@ def map_fieldnames(fieldnames, cols_from, cols_to):
     return result
 
 
+class ColumnMapper:
+    '''Maps the values of `cols_from` to the values of `cols_to` in rows
+       given as lists of values of `fieldnames`. `mapping` is a dict of
+       key tuples to value tuples, as returned by `load_mapping()`.'''
+
+    def __init__(self, mapping, fieldnames, cols_from, cols_to):
+        self.mapping = mapping
+        self.fieldnames = map_fieldnames(fieldnames, cols_from, cols_to)
+        self.get_key = _getter([fieldnames.index(c) for c in cols_from], tuple)
+        # the output row is taken from the input row followed by the
+        # mapped values
+        positions = [fieldnames.index(f) if f not in cols_to \
+                     else len(fieldnames) + cols_to.index(f) \
+                     for f in self.fieldnames]
+        self.get_row = _getter(positions)
+
+    def __call__(self, row):
+        '''Return the mapped row, or None if the key is not mapped.'''
+        val = self.mapping.get(self.get_key(row))
+        if val is None:
+            return None
+        return self.get_row((*row, *val))
+
+
+def _getter(indices, result=list):
+    # like itemgetter, but always returning a list (or tuple)
+    if len(indices) == 1:
+        i = indices[0]
+        return lambda row: result((row[i],))
+    getter = itemgetter(*indices)
+    return getter if result is tuple else lambda row: result(getter(row))
+
+
+def _row_lists(reader):
+    # the rows of a reader from `table_reader` as lists of values
+    if isinstance(reader, csv.DictReader):
+        n = len(reader.fieldnames)
+        for row in reader.reader:
+            if len(row) < n:
+                if not row:
+                    continue
+                row += [''] * (n-len(row))
+            yield row
+    else:
+        for row in reader:
+            yield [row[f] for f in reader.fieldnames]
+
+
+def map_rows(rows, mappers, unique=False, hashed=False):
+    '''Apply the mappers to the rows in turn, leaving out the rows with
+       unmapped keys. With `unique`, duplicate output rows are left out.
+       With `hashed`, the rows seen are only kept as 64-bit hashes, which
+       saves memory, but a row is also left out if its hash collides with
+       that of a different row.'''
+    seen = set()
+    for row in rows:
+        for mapper in mappers:
+            row = mapper(row)
+            if row is None:
+                break
+        else:
+            if unique:
+                key = hash(tuple(row)) if hashed else tuple(row)
+                if key in seen:
+                    continue
+                seen.add(key)
+            yield row
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser(
         description='Map column combinations in the CSV.')
@@ -37,36 +107,46 @@ def parse_arguments():
         '-f', '--cols-from', help='The columns of the input key.')
     parser.add_argument(
         '-t', '--cols-to', help='The columns of the output key.')
+    parser.add_argument(
+        '-M', '--map', nargs=3, action='append', default=[],
+        metavar=('FILE', 'FROM', 'TO'),
+        help='A mapping of the columns FROM to the columns TO'
+             ' (comma-separated) given in FILE. Can be repeated, the'
+             ' mappings are applied in the given order.')
     parser.add_argument(
         '-u', '--unique', action='store_true',
         help='Do not output duplicate rows.')
-    parser.add_argument('map_file', help='The file containing the mapping.')
-    return parser.parse_args()
+    parser.add_argument(
+        '--hash-rows', action='store_true',
+        help='With -u, remember only 64-bit hashes of the rows output so'
+             ' far, to save memory (distinct rows with colliding hashes'
+             ' are then left out).')
+    parser.add_argument(
+        'map_file', nargs='?', help='The file containing the mapping.')
+    args = parser.parse_args()
+    if args.map_file is not None:
+        if args.cols_from is None or args.cols_to is None:
+            parser.error('-f and -t are required with a map file')
+        args.map.insert(0, (args.map_file, args.cols_from, args.cols_to))
+    if not args.map:
+        parser.error('no mapping given')
+    return args
 
 
 def main():
     args = parse_arguments()
-    cols_from = args.cols_from.split(',')
-    cols_to = args.cols_to.split(',')
-    mapping = load_mapping(args.map_file, cols_from, cols_to)
-    reader = csv.DictReader(sys.stdin)
-    fieldnames = map_fieldnames(reader.fieldnames, cols_from, cols_to)
-    writer = csv.DictWriter(sys.stdout, fieldnames, lineterminator='\n')
-    writer.writeheader()
-    seen = set()
-    for row in reader:
-        key = tuple(row[c] for c in cols_from)
-        if key in mapping:
-            for c in cols_from:
-                del row[c]
-            for i, c in enumerate(cols_to):
-                row[c] = mapping[key][i]
-            if not args.unique or tuple(row.values()) not in seen:
-                writer.writerow(row)
-            if args.unique:
-                seen.add(tuple(row.values()))
+    with table_reader(sys.stdin) as reader:
+        fieldnames, mappers = reader.fieldnames, []
+        for map_file, cols_from, cols_to in args.map:
+            cols_from, cols_to = cols_from.split(','), cols_to.split(',')
+            mapping = load_mapping(map_file, cols_from, cols_to)
+            mappers.append(ColumnMapper(mapping, fieldnames, cols_from, cols_to))
+            fieldnames = mappers[-1].fieldnames
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow(fieldnames)
+        writer.writerows(map_rows(_row_lists(reader), mappers, args.unique,
+                                  args.hash_rows))
 
 
 if __name__ == '__main__':
     main()
-
@@ -11,6 +11,8 @@ import time
 from shortsim.ngrcos import vectorize
 from matrix_align import matrix_align
 
+from table_io import table_reader
+
 
 # The maximum size of the alignment matrix between one poem and the rest.
 # If the matrix is too large, it will be split and computed in parts.
@@ -22,8 +24,7 @@ MAX_SIZE = 3758096384/4              # this many 16-bit numbers =~ 7G
 
 def read_input(filename):
     verses = []
-    with open(filename) as fp:
-        reader = csv.DictReader(fp)
+    with table_reader(filename) as reader:
         for line in reader:
             verses.append((line['poem_id'], line['pos'], line['text']))
     return verses
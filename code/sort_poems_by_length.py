@@ -1,19 +1,87 @@
 # Takes a CSV file containing poems (poem_id pos line).
 # Sorts the poems from the longest to the shortest.
+#
+# Only an index of the poems (byte offset, size and number of verses) is
+# kept in memory: the poems are then copied from the input in the sorted
+# order. If the input is not seekable, it is spooled to a temporary file.
 
 import csv
+import io
+import shutil
 import sys
+import tempfile
 
-reader = csv.DictReader(sys.stdin)
-writer = csv.DictWriter(sys.stdout, reader.fieldnames)
-writer.writeheader()
-data = []
-for r in reader:
-    if data and data[-1][-1]['poem_id'] == r['poem_id']:
-        data[-1].append(r)
+import numpy as np
+
+
+class LineReader:
+    '''Iterate over the lines of a binary file as strings, keeping track
+       of the byte offset of the end of the last line read.'''
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.pos = fp.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.fp.readline()
+        if not line:
+            raise StopIteration()
+        self.pos += len(line)
+        return line.decode('utf-8')
+
+
+def index_poems(fp):
+    '''Read the header and find the poems (runs of rows with the same
+       `poem_id`). Returns the header and arrays of byte offsets, sizes
+       and numbers of rows of the poems.'''
+    lines = LineReader(fp)
+    reader = csv.reader(lines)
+    header = next(reader)
+    idx = header.index('poem_id')
+    offsets, lengths = [], []
+    start, cur_id = lines.pos, None
+    for row in reader:
+        if not row:
+            # empty lines are skipped, like in csv.DictReader
+            continue
+        if lengths and row[idx] == cur_id:
+            lengths[-1] += 1
+        else:
+            offsets.append(start)
+            lengths.append(1)
+            cur_id = row[idx]
+        start = lines.pos
+    offsets.append(start)
+    offsets = np.array(offsets, dtype=np.int64)
+    return header, offsets[:-1], np.diff(offsets), \
+           np.array(lengths, dtype=np.int64)
+
+
+def sort_poems(fp, outfp):
+    header, offsets, sizes, lengths = index_poems(fp)
+    writer = csv.writer(outfp)
+    writer.writerow(header)
+    # stable, so that poems of equal length stay in the input order
+    for i in np.argsort(-lengths, kind='stable'):
+        fp.seek(offsets[i])
+        data = fp.read(sizes[i]).decode('utf-8')
+        writer.writerows(
+            row for row in csv.reader(io.StringIO(data, newline='')) if row)
+
+
+def main():
+    infp = sys.stdin.buffer
+    if infp.seekable():
+        sort_poems(infp, sys.stdout)
     else:
-        data.append([r])
-data.sort(reverse=True, key=len)
-for d in data:
-    writer.writerows(d)
+        with tempfile.TemporaryFile() as fp:
+            shutil.copyfileobj(infp, fp)
+            fp.seek(0)
+            sort_poems(fp, sys.stdout)
+
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+'''Reading and writing tables as CSV or Parquet.
+
+Parquet files are recognized by the `.parquet` extension (or, for input
+streams, by the magic number). Reading Parquet returns the same rows as
+reading the corresponding CSV with `csv.DictReader`, i.e. dicts of strings
+with empty strings for missing values, so the scripts can use both
+formats interchangeably.'''
+
+from contextlib import contextmanager
+import csv
+import io
+import os.path as P
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+PARQUET_MAGIC = b'PAR1'
+
+# Columns with few distinct values, stored dictionary-encoded in Parquet.
+DICTIONARY_COLUMNS = { 'poem_id', 'verse_type', 'collection', 'field',
+                       'place_id', 'collector_id', 'type_id', 'ref_type' }
+INTEGER_COLUMNS = { 'pos' }
+
+
+def is_parquet(filename):
+    return filename.endswith('.parquet')
+
+
+def table_filename(filename, fmt='csv'):
+    '''Change the extension of a table file name according to the format.'''
+    if fmt == 'parquet':
+        return P.splitext(filename)[0] + '.parquet'
+    return filename
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('Parquet support requires pyarrow')
+
+
+def _column_type(name):
+    if name in INTEGER_COLUMNS:
+        return pa.int64()
+    elif name in DICTIONARY_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+class ParquetDictWriter:
+    '''A writer with the interface of `csv.DictWriter` that writes
+       a Parquet file in batches of `batch_size` rows.'''
+
+    def __init__(self, filename, fieldnames, batch_size=100000):
+        _require_pyarrow()
+        self.fieldnames = list(fieldnames)
+        self.batch_size = batch_size
+        self.schema = pa.schema([(f, _column_type(f)) \
+                                 for f in self.fieldnames])
+        self.writer = pq.ParquetWriter(filename, self.schema)
+        self.columns = { f: [] for f in self.fieldnames }
+        self.num_rows = 0
+
+    def writeheader(self):
+        pass
+
+    def writerow(self, row):
+        extra = [key for key in row if key not in self.columns]
+        if extra:
+            raise ValueError('dict contains fields not in fieldnames: '
+                             + ', '.join(map(repr, extra)))
+        for f, values in self.columns.items():
+            values.append(row.get(f))
+        self.num_rows += 1
+        if self.num_rows >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if not self.num_rows:
+            return
+        arrays = []
+        for f in self.fieldnames:
+            values = self.columns[f]
+            if f in INTEGER_COLUMNS:
+                values = [int(v) if v not in (None, '') else None \
+                          for v in values]
+                arrays.append(pa.array(values, pa.int64()))
+            else:
+                values = [str(v) if v is not None else None for v in values]
+                array = pa.array(values, pa.string())
+                if f in DICTIONARY_COLUMNS:
+                    array = array.dictionary_encode()
+                arrays.append(array)
+            self.columns[f] = []
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.num_rows = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class ParquetDictReader:
+    '''A reader with the interface of `csv.DictReader` for Parquet files.'''
+
+    def __init__(self, source, batch_size=100000):
+        _require_pyarrow()
+        self.file = pq.ParquetFile(source)
+        self.fieldnames = self.file.schema_arrow.names
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        for batch in self.file.iter_batches(batch_size=self.batch_size):
+            columns = [pc.fill_null(col.cast(pa.string()), '') \
+                       for col in batch.columns]
+            yield from pa.RecordBatch.from_arrays(
+                columns, names=self.fieldnames).to_pylist()
+
+
+@contextmanager
+def table_writer(filename, fieldnames, write_header=True, **kwargs):
+    '''Open a table for writing. Yields a `csv.DictWriter` (with the header
+       already written if `write_header`), or a `ParquetDictWriter` if the
+       file name ends with `.parquet`. Keyword arguments are passed to
+       `csv.DictWriter`.'''
+    if is_parquet(filename):
+        writer = ParquetDictWriter(filename, fieldnames)
+        try:
+            yield writer
+        finally:
+            writer.close()
+    else:
+        with open(filename, 'w+') as fp:
+            writer = csv.DictWriter(fp, fieldnames, **kwargs)
+            if write_header:
+                writer.writeheader()
+            yield writer
+
+
+@contextmanager
+def table_reader(source):
+    '''Open a table for reading. `source` is a file name or a text stream
+       (e.g. `sys.stdin`). Yields a `csv.DictReader` or a
+       `ParquetDictReader`.'''
+    if isinstance(source, str):
+        if is_parquet(source):
+            yield ParquetDictReader(source)
+        else:
+            with open(source) as fp:
+                yield csv.DictReader(fp)
+    elif hasattr(source, 'buffer') \
+            and source.buffer.peek(4)[:4] == PARQUET_MAGIC:
+        # Parquet needs random access, so the stream is read into memory
+        yield ParquetDictReader(io.BytesIO(source.buffer.read()))
+    else:
+        yield csv.DictReader(source)
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+# Takes the verses table (poem_id, pos, verse_type, text), keeps the verses
+# proper (verse_type matching "V"), cleans them and splits them into words.
+# Writes the cleaned verses (poem_id, pos, text) and the word occurrences
+# (poem_id, pos, word_pos, text) in a single pass.
+
+import argparse
+import csv
+import itertools
+from multiprocessing import Pool
+import re
+
+from clean_verses import clean, clean_all, read_chunks
+from table_io import table_reader
+
+
+def filter_verses(rows, verse_type):
+    pattern = re.compile(verse_type)
+    for row in rows:
+        if pattern.search(row['verse_type']):
+            yield row['poem_id'], row['pos'], row['text']
+
+
+def clean_chunks(verses, chunk_size=10000, workers=1):
+    '''Clean the texts of (poem_id, pos, text) tuples, yielding lists of
+       cleaned tuples in the input order.'''
+    chunks = read_chunks(verses, chunk_size)
+    if workers <= 1:
+        for chunk in chunks:
+            yield [(poem_id, pos, clean(text)) for poem_id, pos, text in chunk]
+        return
+    with Pool(workers) as pool:
+        while True:
+            # a few chunks per process at a time to bound memory
+            batch = list(itertools.islice(chunks, 2*workers))
+            if not batch:
+                break
+            results = pool.map(clean_all, \
+                [[text for poem_id, pos, text in chunk] for chunk in batch])
+            for chunk, cleaned in zip(batch, results):
+                yield [(poem_id, pos, text) \
+                       for (poem_id, pos, _), text in zip(chunk, cleaned)]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Clean and tokenize the verses.')
+    parser.add_argument(
+        '-i', '--input-file', metavar='FILE', required=True,
+        help='The verses table (CSV or Parquet).')
+    parser.add_argument(
+        '-o', '--verses-file', metavar='FILE', required=True,
+        help='Output file for the cleaned verses (poem_id, pos, text).')
+    parser.add_argument(
+        '-w', '--words-file', metavar='FILE', required=True,
+        help='Output file for the word occurrences'
+             ' (poem_id, pos, word_pos, text).')
+    parser.add_argument(
+        '-t', '--verse-type', default='V',
+        help='Regular expression for the types of verses to keep'
+             ' (default: V).')
+    parser.add_argument(
+        '-j', '--workers', type=int, default=1,
+        help='Number of processes to clean the verses in (default: 1).')
+    parser.add_argument(
+        '--chunk-size', type=int, default=10000,
+        help='Number of verses sent to a process at once (default: 10000).')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    with table_reader(args.input_file) as reader, \
+         open(args.verses_file, 'w+') as vfp, \
+         open(args.words_file, 'w+') as wfp:
+        v_writer = csv.writer(vfp, lineterminator='\n')
+        w_writer = csv.writer(wfp, lineterminator='\n')
+        v_writer.writerow(('poem_id', 'pos', 'text'))
+        w_writer.writerow(('poem_id', 'pos', 'word_pos', 'text'))
+        verses = filter_verses(reader, args.verse_type)
+        for chunk in clean_chunks(verses, args.chunk_size, args.workers):
+            v_writer.writerows(chunk)
+            w_writer.writerows(
+                (poem_id, pos, i, word) for poem_id, pos, text in chunk \
+                for i, word in enumerate(text.split(), 1))
+
+
+if __name__ == '__main__':
+    main()
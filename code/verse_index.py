@@ -0,0 +1,234 @@
+import argparse
+from collections import Counter
+import csv
+import logging
+import numpy as np
+import sys
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+from clean_verses import clean
+from table_io import table_reader
+
+
+# `ngrams()` and `vectorize()` produce the same vectors as
+# `shortsim.ngrcos.vectorize`, which cannot be reused here, because it
+# chooses the features from the given texts themselves: the queries must
+# be vectorized with the features of the index.
+
+def ngrams(text, n):
+    text = ' '*(n-1) + text + ' '*(n-1)
+    return [text[i:i+n] for i in range(len(text)-n+1)]
+
+
+def vectorize(texts, ngram_ids, n=2, weighting='plain'):
+    m = np.zeros((len(texts), len(ngram_ids)), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for ngr, freq in Counter(ngrams(text, n)).items():
+            if ngr in ngram_ids:
+                m[i, ngram_ids[ngr]] = freq
+    if weighting == 'sqrt':
+        m = np.sqrt(m)
+    elif weighting == 'binary':
+        m = (m > 0).astype(np.float32)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return np.divide(m, norms, out=m, where=norms > 0)
+
+
+def pack_strings(strings):
+    '''Store strings as the concatenation of their UTF-8 encodings and
+       an array of offsets, instead of a fixed-width array that takes the
+       space of the longest string for every string.'''
+    encoded = [s.encode('utf-8') for s in strings]
+    ptr = np.zeros(len(encoded)+1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=ptr[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), ptr
+
+
+def unpack_strings(data, ptr):
+    data = data.tobytes()
+    return [data[i:j].decode('utf-8') for i, j in zip(ptr[:-1], ptr[1:])]
+
+
+def read_verses(filename):
+    '''Read the cleaned verses table. Returns the list of unique verse
+       texts and the occurrences (verse_idx, poem_id, pos) of each.'''
+    verse_ids, occurrences = {}, []
+    with table_reader(filename) as reader:
+        for row in reader:
+            text = row['text'].strip()
+            if not text:
+                continue
+            if text not in verse_ids:
+                verse_ids[text] = len(verse_ids)
+            occurrences.append((verse_ids[text], row['poem_id'], row['pos']))
+    return list(verse_ids), occurrences
+
+
+class VerseIndex:
+    '''A nearest-neighbour index over n-gram vectors of unique verses.
+
+       The vectors use the same parameters (n, dim, weighting) as
+       `shortsim-ngrcos` and `poem_sim.py`: the `dim` most frequent
+       n-grams are the features, weighted and normalized to unit length,
+       so that the inner product is the cosine similarity.'''
+
+    def __init__(self, verses, ngram_list, vectors, occ_ptr, occ_poem_ids,
+                 occ_pos, n=2, weighting='plain'):
+        self.verses = verses
+        self.ngram_list = ngram_list
+        self.ngram_ids = { ngr: i for i, ngr in enumerate(ngram_list) }
+        self.vectors = vectors
+        self.occ_ptr = occ_ptr
+        self.occ_poem_ids = occ_poem_ids
+        self.occ_pos = occ_pos
+        self.n = n
+        self.weighting = weighting
+        self.faiss_index = None
+        if faiss is not None:
+            self.faiss_index = faiss.IndexFlatIP(vectors.shape[1])
+            self.faiss_index.add(vectors)
+
+    @staticmethod
+    def build(verses, occurrences, n=2, dim=450, weighting='plain'):
+        ngr_freq = Counter(ngr for v in verses for ngr in ngrams(v, n))
+        ngram_list = [ngr for ngr, freq in ngr_freq.most_common(dim)]
+        vectors = vectorize(
+            verses, { ngr: i for i, ngr in enumerate(ngram_list) },
+            n=n, weighting=weighting)
+        occurrences = sorted(occurrences, key=lambda x: x[0])
+        occ_ptr = np.zeros(len(verses)+1, dtype=np.int64)
+        np.cumsum(np.bincount([o[0] for o in occurrences],
+                              minlength=len(verses)),
+                  out=occ_ptr[1:])
+        return VerseIndex(
+            list(verses), np.array(ngram_list), vectors, occ_ptr,
+            np.array([o[1] for o in occurrences]),
+            np.array([int(o[2]) for o in occurrences], dtype=np.int32),
+            n=n, weighting=weighting)
+
+    def occurrences(self, verse_idx):
+        i, j = self.occ_ptr[verse_idx], self.occ_ptr[verse_idx+1]
+        return list(zip(self.occ_poem_ids[i:j].tolist(),
+                        self.occ_pos[i:j].tolist()))
+
+    def search(self, texts, k=10):
+        '''Return for each query text a list of (verse, sim, occurrences)
+           for the `k` most similar verses.'''
+        q = vectorize([clean(t) for t in texts], self.ngram_ids,
+                      n=self.n, weighting=self.weighting)
+        k = min(k, self.vectors.shape[0])
+        if self.faiss_index is not None:
+            sims, idx = self.faiss_index.search(q, k)
+        else:
+            s = q @ self.vectors.T
+            idx = np.argpartition(-s, k-1, axis=1)[:,:k]
+            sims = np.take_along_axis(s, idx, axis=1)
+            order = np.argsort(-sims, axis=1, kind='stable')
+            idx = np.take_along_axis(idx, order, axis=1)
+            sims = np.take_along_axis(sims, order, axis=1)
+        return [[(self.verses[j], float(sim), self.occurrences(j)) \
+                 for j, sim in zip(idx_row, sims_row) if j > -1] \
+                for idx_row, sims_row in zip(idx, sims)]
+
+    def save(self, filename):
+        verses_data, verses_ptr = pack_strings(self.verses)
+        np.savez(filename,
+                 verses_data=verses_data, verses_ptr=verses_ptr,
+                 ngrams=self.ngram_list,
+                 vectors=self.vectors, occ_ptr=self.occ_ptr,
+                 occ_poem_ids=self.occ_poem_ids, occ_pos=self.occ_pos,
+                 n=self.n, weighting=self.weighting)
+
+    @staticmethod
+    def load(filename):
+        with np.load(filename) as data:
+            return VerseIndex(
+                unpack_strings(data['verses_data'], data['verses_ptr']),
+                data['ngrams'].tolist(), data['vectors'],
+                data['occ_ptr'], data['occ_poem_ids'], data['occ_pos'],
+                n=int(data['n']), weighting=str(data['weighting']))
+
+
+def read_batches(fp, batch_size):
+    '''Read the lines of fp in lists of `batch_size`, so that the results
+       for a long stream of queries are written as it is read.'''
+    batch = []
+    for line in fp:
+        batch.append(line.rstrip('\n'))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Build or query a nearest-neighbour index of verses.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser(
+        'build', help='Build the index from the cleaned verses table.')
+    build_parser.add_argument(
+        '-i', '--input-file', metavar='FILE', required=True,
+        help='Input file (CSV: poem_id, pos, text)')
+    build_parser.add_argument(
+        '-o', '--index-file', metavar='FILE', required=True,
+        help='File to write the index to (.npz).')
+    build_parser.add_argument(
+        '-d', '--dim', type=int, default=450,
+        help='The number of dimensions of n-gram vectors for verses')
+    build_parser.add_argument(
+        '-n', type=int, default=2,
+        help='The size (`n`) of the n-grams (default: 2, i.e. ngrams).')
+    build_parser.add_argument(
+        '-w', '--weighting', choices=['plain', 'sqrt', 'binary'],
+        default='plain', help='Weighting of n-gram frequencies.')
+    query_parser = subparsers.add_parser(
+        'query', help='Find the verses most similar to the given ones.',
+        description='Find the verses most similar to the given ones. The'
+                    ' index is loaded (and the faiss index built) once per'
+                    ' invocation, so pass all queries to a single run, e.g.'
+                    ' on stdin.')
+    query_parser.add_argument(
+        '-I', '--index-file', metavar='FILE', required=True,
+        help='The index file created with `build`.')
+    query_parser.add_argument(
+        '-k', type=int, default=10,
+        help='The number of most similar verses to return (default: 10).')
+    query_parser.add_argument(
+        'queries', nargs='*', metavar='VERSE',
+        help='Verses to search for (default: read lines from stdin).')
+    query_parser.add_argument(
+        '-b', '--batch-size', type=int, default=1000,
+        help='The number of queries from stdin to search at once'
+             ' (default: 1000).')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.command == 'build':
+        verses, occurrences = read_verses(args.input_file)
+        logging.info('building index for {} verses'.format(len(verses)))
+        index = VerseIndex.build(verses, occurrences, n=args.n, dim=args.dim,
+                                 weighting=args.weighting)
+        index.save(args.index_file)
+    elif args.command == 'query':
+        index = VerseIndex.load(args.index_file)
+        batches = [args.queries] if args.queries \
+                  else read_batches(sys.stdin, args.batch_size)
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow(('query', 'text', 'sim', 'poem_id', 'pos'))
+        for queries in batches:
+            for query, results in zip(queries, index.search(queries, k=args.k)):
+                for text, sim, occurrences in results:
+                    for poem_id, pos in occurrences:
+                        writer.writerow((query, text, sim, poem_id, pos))
+
+
+if __name__ == '__main__':
+    main()
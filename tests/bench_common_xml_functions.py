@@ -0,0 +1,65 @@
+'''Compare the speed of the old and new `elem_content_to_str()` and
+`insert_refnrs()` on the elements of XML files, e.g.:
+
+    python3 tests/bench_common_xml_functions.py data/raw/kr/*.xml
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import lxml.etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'code'))
+
+from common_xml_functions import elem_content_to_str, insert_refnrs
+from test_common_xml_functions import SAMPLE_FILE, old_elem_content_to_str, \
+    old_insert_refnrs
+
+
+def timed(func, args, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        for arg in args:
+            func(arg)
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    return best
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the old and new XML content helpers.')
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='The number of runs, of which the fastest is reported'
+             ' (default: 3).')
+    parser.add_argument(
+        'files', nargs='*', metavar='FILE', default=[SAMPLE_FILE],
+        help='XML files (default: modifications/lonnrot_exceptions.xml).')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    # the verse and metadata elements, as converted by convert_skvr.py
+    elems = [elem for filename in args.files
+             for elem in lxml.etree.parse(filename).iter()
+             if elem.getparent() is not None
+                and elem.getparent().tag in ('TEXT', 'META')]
+    texts = [elem_content_to_str(elem) for elem in elems]
+    print('{} elements'.format(len(elems)))
+    for name, old, new, data in (
+            ('elem_content_to_str', old_elem_content_to_str,
+             elem_content_to_str, elems),
+            ('insert_refnrs', old_insert_refnrs, insert_refnrs, texts)):
+        t_old = timed(old, data, args.repeat)
+        t_new = timed(new, data, args.repeat)
+        print('{:20} old {:7.3f} s  new {:7.3f} s  speedup {:.1f}x'\
+              .format(name, t_old, t_new, t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import random
+
+import pytest
+
+from add_type_links import _add_links_sequential, add_links, build_type_names_trie
+
+
+# The implementation before the trie was flattened, as the reference.
+
+def old_trie_insert(trie, key, value):
+    if not isinstance(key, str):
+        raise KeyError('Invalid key {}: must be a non-empty string!'.format(key))
+    if len(key) == 0:
+        trie[''] = value
+    else:
+        if not key[0] in trie:
+            trie[key[0]] = {}
+        old_trie_insert(trie[key[0]], key[1:], value)
+
+
+def old_trie_bfs(trie, max_depth=1000):
+    queue = [(0, trie)]
+    results = []
+    while queue:
+        (depth, node) = queue.pop(0)
+        if '' in node:
+            results.append((depth, node['']))
+        if depth < max_depth:
+            queue.extend([(depth+1, child) for key, child in node.items() if key != ''])
+    return results
+
+
+def old_trie_match(trie, query, depth=0, min_depth=0, max_bfs_depth=1000):
+    if not query:
+        return depth, [(0, trie[''])] if '' in trie else []
+    if query[0] not in trie:
+        if depth >= min_depth:
+            return depth, old_trie_bfs(trie, max_depth=max_bfs_depth)
+        else:
+            return depth, []
+    else:
+        return old_trie_match(trie[query[0]], query[1:], depth=depth+1)
+
+
+def old_add_links(types, description, threshold):
+    trie = {}
+    for t in types:
+        old_trie_insert(trie, t['type_name'], t['type_id'])
+    i = description.find('&gt;')
+    while i > -1:
+        query = description[i+len('&gt;'):]
+        j, matches = old_trie_match(trie, query, min_depth=7, max_bfs_depth=5)
+        if matches and j/(j+matches[0][0]) > threshold:
+            k = i+len('&gt;')+j
+            while k < len(description) and description[k].isalpha():
+                k += 1
+            linktext = description[i+len('&gt;'):k]
+            description = description.replace(
+                '&gt;'+linktext,
+                '&gt;[{}|{}]'.format(matches[0][1], linktext))
+        i = description.find('&gt;', i+1)
+    return description
+
+
+NAMES = ['Sampo', 'Sammon taonta', 'Sammon ryöstö', 'Sam', 'Kullervo', 'Kulta',
+         'Kultaneito', 'Kultainen lintu', 'Kalevala', 'Kale']
+
+TEXTS = [
+    '',
+    'ei viittauksia',
+    'katso &gt;Sampo ja &gt;Sammon taonta',
+    '&gt;Sammon ryöstö, &gt;Sammon, &gt;Sam ja &gt;Sampo',
+    '&gt;Kultaneito &gt;Kulta &gt;Kultainen lintu &gt;Kultaneidon',
+    '&gt;Kale &gt;Kalevala &gt;Kalevalan &gt;Kalev',
+    '&gt;&gt;Sampo &gt;Kullervo&gt;Kulta &gt;',
+    '&gt;Sampo &gt;Sampo &gt;Sampoja &gt;Sam',
+    '&gt;Tuntematon &gt;K &gt;S',
+]
+
+
+def types(names):
+    return [{'type_id': 't{}'.format(i), 'type_name': name} for i, name in enumerate(names)]
+
+
+@pytest.mark.parametrize('threshold', [0, 0.5, 0.8, 1])
+@pytest.mark.parametrize('text', TEXTS)
+def test_same_as_sequential(text, threshold):
+    trie = build_type_names_trie(types(NAMES))
+    assert add_links(text, trie, threshold) == _add_links_sequential(text, trie, threshold)
+
+
+@pytest.mark.parametrize('threshold', [0, 0.5, 0.8, 1])
+@pytest.mark.parametrize('text', TEXTS)
+def test_same_as_old(text, threshold):
+    trie = build_type_names_trie(types(NAMES))
+    assert add_links(text, trie, threshold) == old_add_links(types(NAMES), text, threshold)
+
+
+def test_same_as_sequential_random():
+    rng = random.Random(0)
+    for _ in range(2000):
+        names = list(dict.fromkeys(
+            ''.join(rng.choice('ab ') for _ in range(rng.randint(1, 4)))
+            for _ in range(rng.randint(1, 6))))
+        trie = build_type_names_trie(types(names))
+        text = ''.join(rng.choice(['&gt;', 'a', 'b', ' ', 'ab']) for _ in range(rng.randint(0, 12)))
+        threshold = rng.choice([0, 0.5, 0.8])
+        assert add_links(text, trie, threshold) == _add_links_sequential(text, trie, threshold), \
+            (names, text, threshold)
+
+
+def test_same_as_old_random():
+    rng = random.Random(1)
+    for _ in range(2000):
+        names = list(dict.fromkeys(
+            ''.join(rng.choice(['a', 'b', ' ', ',', '&', 'gt;']) for _ in range(rng.randint(1, 5)))
+            for _ in range(rng.randint(1, 6))))
+        trie = build_type_names_trie(types(names))
+        text = ''.join(rng.choice(['&gt;', 'a', 'b', ' ', 'ab', ',', '&'])
+                       for _ in range(rng.randint(0, 12)))
+        threshold = rng.choice([0, 0.5, 0.7, 0.8])
+        assert add_links(text, trie, threshold) == old_add_links(types(names), text, threshold), \
+            (names, text, threshold)
@@ -0,0 +1,80 @@
+import csv
+import io
+import os
+import random
+import re
+import subprocess
+import sys
+
+import pytest
+
+from clean_verses import clean
+
+
+SCRIPT = os.path.join(os.path.dirname(__file__), os.pardir, 'code', 'clean_verses.py')
+
+
+def old_clean(string):
+    # the implementation before the memoised one, as the reference
+    string = re.sub('[0-9]', '', string)
+    string = re.sub(r'<\/?([A-Z]+)>', '', string)
+    string = string.lower().strip()
+    string = re.sub(r' \W+$', '', string)
+    string = re.sub(r'^\W+ ', '', string)
+    string = re.sub(r'\s+', '_', string)
+    string = re.sub(r'\W', '', string)
+    string = re.sub('_', ' ', string)
+    return string
+
+
+VERSES = [
+    '',
+    'Vaka vanha Väinämöinen',
+    '  tietäjä iän-ikuinen, ',
+    'Sanoi<REFNR>1</REFNR> vanha #2 Väinämöinen:',
+    '<I>Läksi</I> <U>nuori</U> Joukahainen!',
+    '- Ja kun ei, niin ei -',
+    '"Lähe kanssa laulamahan"',
+    'Tuli\ttuli\ntuli\xa0tuli',
+    'snake_case ja __alaviivat__',
+    '123 numeroita 4567 ja ٣ muita',
+    '<ä>pienet</ä> <Å>tagit</Å>',
+    '... ???',
+]
+
+
+def random_verse(rng):
+    parts = ['vaka', 'VANHA', 'ä', 'Ö', ' ', '  ', '\t', ',', '.', '-', '!', '_',
+             '1', '42', '<I>', '</I>', '<REFNR>', '</REFNR>', '<x>', '"', "'", '\xa0']
+    return ''.join(rng.choice(parts) for _ in range(rng.randint(0, 12)))
+
+
+@pytest.mark.parametrize('verse', VERSES)
+def test_same_as_old(verse):
+    assert clean(verse) == old_clean(verse)
+
+
+def test_same_as_old_random():
+    rng = random.Random(0)
+    for _ in range(5000):
+        verse = random_verse(rng)
+        assert clean(verse) == old_clean(verse), verse
+
+
+def run(input_data, *args):
+    return subprocess.run([sys.executable, SCRIPT] + list(args), input=input_data,
+                          stdout=subprocess.PIPE, check=True).stdout
+
+
+def test_parallel_same_as_serial():
+    rng = random.Random(1)
+    fp = io.StringIO()
+    writer = csv.writer(fp, lineterminator='\n')
+    writer.writerow(('poem_id', 'pos', 'text'))
+    for i in range(1000):
+        writer.writerow(('p{}'.format(i // 20), i % 20 + 1,
+                         rng.choice(VERSES + [random_verse(rng)])))
+    data = fp.getvalue().encode('utf-8')
+    serial = run(data)
+    assert run(data, '-j', '3', '--chunk-size', '37') == serial
+    assert serial.count(b'\n') == 1001
@@ -0,0 +1,87 @@
+import shutil
+import subprocess
+
+import pytest
+
+from combine import TABLES, combine
+
+
+WORK_TABLES = {
+    'skvr': {
+        'collectors.csv': 'collector_id,name\nskvr_k1,"Lönnrot, Elias"\nskvr_k2,\n',
+        'places.csv': 'place_id,name,county\nskvr_p1,Vuokkiniemi,Vienan Karjala\n',
+        'poems.csv': 'poem_id,collection,nro\nskvr01100010,skvr,1\nskvr01100020,skvr,2\n',
+        'meta.csv': 'poem_id,collector_id,place_id,year\n'
+                    'skvr01100010,skvr_k1,skvr_p1,1834\nskvr01100020,,skvr_p1,\n',
+        'poem_types.csv': 'poem_id,type_id,type_is_minor\nskvr01100010,t1,0\n',
+        'raw_meta.csv': 'poem_id,field,value\nskvr01100010,LOC,"Vuokkiniemi\nKivijärvi"\n',
+        'refs.csv': 'poem_id,ref_number,ref_type,ref\nskvr01100010,1,REF,"""lainaus"""\n',
+        'types.csv': 'type_id,type_name,type_description,type_parent_id,type_comparison\n'
+                     't1,Sammon taonta,"kuvaus, pitkä",t0,x\n',
+        'verses.csv': 'poem_id,pos,verse_type,text\nskvr01100010,1,V,Vaka vanha Väinämöinen\n'
+                      'skvr01100010,2,V,"tietäjä, iän-ikuinen"\n',
+        'verses_cl.csv': 'poem_id,pos,text\nskvr01100010,1,vaka vanha väinämöinen\n',
+        'word_occ.csv': 'poem_id,pos,word_id\nskvr01100010,1,vaka\n',
+    },
+    'jr': {
+        'poems.csv': 'poem_id,collection,nro\njr001,jr,1\n',
+        'poem_collector.csv': 'poem_id,collector_id\njr001,jr_k1\n',
+        'poem_place.csv': 'poem_id,place_id\njr001,\n',
+        'poem_year.csv': 'poem_id,year\njr001,1930\n',
+        'raw_meta.csv': 'poem_id,field,value\njr001,KOG,x\n',
+        'refs.csv': 'poem_id,ref_number,ref_type,ref\n',
+        'verses.csv': 'poem_id,pos,verse_type,text\njr001,1,V,tuli tuli\n',
+        'verses_cl.csv': 'poem_id,pos,text\njr001,1,tuli tuli\n',
+        'word_occ.csv': 'poem_id,pos,word_id\njr001,1,tuli\n',
+    },
+    'kr': {
+        'collectors.csv': 'collector_id,name\nkr_k1,Europaeus\n',
+        'places.csv': 'place_id,name,county\nkr_p1,Ilomantsi,\n',
+        'poems.csv': 'poem_id,collection,nro\nkr01_1,kr,1\nkr01_2,kr,2\n',
+        'meta.csv': 'poem_id,collector_id,place_id,year\n'
+                    'kr01_1,kr_k1,,1847\nkr01_2,,kr_p1,\n',
+        'poem_types.csv': 'poem_id,type_id,type_is_minor\nkr01_1,t2,1\n',
+        'raw_meta.csv': 'poem_id,field,value\nkr01_1,AIKA,1847\n',
+        'types.csv': 'type_id,type_name,type_description,type_parent_id\nt2,Kosinta,,t0\n',
+        'verses.csv': 'poem_id,pos,verse_type,text\nkr01_1,1,V,"Ja ""vanha"""\n',
+        'verses_cl.csv': 'poem_id,pos,text\nkr01_1,1,ja vanha\n',
+        'word_occ.csv': 'poem_id,pos,word_id\nkr01_1,1,vanha\n',
+    },
+}
+
+
+def run_csvkit(work_dir, output_dir):
+    '''The pipeline that combine.py replaced, as in the old Makefile.'''
+    def sh(command, output):
+        with open(output, 'wb') as fp:
+            subprocess.run(command, shell=True, check=True, stdout=fp, cwd=work_dir)
+
+    for column in ('collector_id', 'place_id', 'year'):
+        table = 'poem_' + column.replace('_id', '') + '.csv'
+        sh('csvcut -c poem_id,{} skvr/meta.csv'.format(column),
+           work_dir / 'skvr' / table)
+        sh("csvcut -c poem_id,{0} kr/meta.csv | csvgrep -c {0} -r '^.+$'".format(column),
+           work_dir / 'kr' / table)
+    for table, (sources, columns) in TABLES.items():
+        command = 'csvstack ' + ' '.join(
+            '{}/{}'.format(s.collection, s.table if s.columns is None else table)
+            for s in sources)
+        if columns is not None:
+            command += ' | csvcut -c ' + ','.join(columns)
+        sh(command, output_dir / table)
+
+
+@pytest.mark.skipif(shutil.which('csvstack') is None, reason='csvkit is not installed')
+def test_same_as_csvkit(tmp_path):
+    work_dir = tmp_path / 'work'
+    for collection, tables in WORK_TABLES.items():
+        (work_dir / collection).mkdir(parents=True)
+        for table, text in tables.items():
+            (work_dir / collection / table).write_text(text, encoding='utf-8')
+    (tmp_path / 'combine').mkdir()
+    (tmp_path / 'csvkit').mkdir()
+    combine(TABLES, str(work_dir), str(tmp_path / 'combine'))
+    run_csvkit(work_dir, tmp_path / 'csvkit')
+    for table in TABLES:
+        assert (tmp_path / 'combine' / table).read_bytes() \
+               == (tmp_path / 'csvkit' / table).read_bytes(), table
@@ -0,0 +1,108 @@
+import logging
+from operator import itemgetter
+import os
+import re
+import xml.etree.ElementTree as ET
+
+import lxml.etree
+import pytest
+
+from common_xml_functions import elem_content_to_str, insert_refnrs
+
+
+SAMPLE_FILE = os.path.join(os.path.dirname(__file__), os.pardir,
+                           'modifications', 'lonnrot_exceptions.xml')
+
+
+# The implementations before they were optimized, as the reference.
+
+def old_elem_content_to_str(elem):
+    text = ET.tostring(elem, encoding='unicode')
+    pattern = '<{}>(.*)</{}>'.format(elem.tag, elem.tag)
+    m = re.match(pattern, text, flags=re.DOTALL)
+    if m is not None:
+        return m.group(1)
+    elif re.match('<{} />'.format(elem.tag), text):
+        return ''
+    else:
+        logging.warning('Pattern \'{}\' does not match string \'{}\'.'\
+                        .format(pattern, text))
+        return elem.text
+
+
+def old_insert_refnrs(text):
+    result = ''
+    m = re.search('(^|[^&])(#([0-9]+)(†|&#8224;)?,?)+', text)
+    while m is not None:
+        refnrs = re.findall('(#([0-9]+)(†|&#8224;)?)', m.group(0))
+        result += text[:m.start()] + m.group(1) + \
+                  '<REFNR>' + ','.join(map(itemgetter(1), refnrs)) + '</REFNR>'
+        text = text[m.end():]
+        m = re.search('(^|[^&])(#([0-9]+)(†|&#8224;)?,?)+', text)
+    result += text
+    return result
+
+
+ELEMENTS = [
+    '<V>vaka vanha väinämöinen</V>',
+    '<V/>',
+    '<V></V>',
+    '<V>a &amp; b &lt;c&gt; "d"</V>',
+    '<V>sanoi<REFNR>1</REFNR> vanha</V>',
+    '<V>alku <I>kursiivi</I> keski <U>alle<SUP>2</SUP></U>loppu</V>',
+    '<V><PAG/> sivu <KA>x</KA></V>',
+    '<V>tail &amp; <B/>jälkeen &lt;</V>',
+    '<V>attr <FR n="2" m="a&amp;b">x</FR> y</V>',
+    '<V lang="fi">attributes on the element</V>',
+    '<V>comment <!-- note --> after</V>',
+    '<V>\n  line\n  <I>break</I>\n</V>',
+    '<REFS>\n#1 eka viite\n#2 toka <I>viite</I>\n</REFS>',
+]
+
+
+def outcome(func, elem):
+    try:
+        return func(elem)
+    except Exception as e:
+        return type(e)
+
+
+@pytest.mark.parametrize('xml', ELEMENTS)
+@pytest.mark.parametrize('parse', [ET.fromstring, lxml.etree.fromstring],
+                         ids=['ElementTree', 'lxml'])
+def test_elem_content_to_str(xml, parse):
+    elem = parse(xml)
+    # (lxml comments cannot be serialized by ElementTree either way)
+    assert outcome(elem_content_to_str, elem) == outcome(old_elem_content_to_str, elem)
+
+
+TEXTS = [
+    'ei viitteitä',
+    '#1 alussa',
+    'sanoi#1 vanha',
+    'sanoi #1, #2 vanha #3',
+    'useita #1,#2,#3†, ja #4&#8224;',
+    'risti #5† ja #6&#8224;#7',
+    'entiteetti &#8224; ja &#35;1 ja a&#1',
+    '##1 ###2, #x #',
+    '#1#2 #3,,#4',
+    'loppu #12',
+]
+
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_insert_refnrs(text):
+    assert insert_refnrs(text) == old_insert_refnrs(text)
+
+
+@pytest.mark.parametrize('parse', [ET.parse, lxml.etree.parse],
+                         ids=['ElementTree', 'lxml'])
+def test_sample_file(parse):
+    n = 0
+    for elem in parse(SAMPLE_FILE).getroot().iter():
+        result = outcome(elem_content_to_str, elem)
+        assert result == outcome(old_elem_content_to_str, elem)
+        if isinstance(result, str):
+            assert insert_refnrs(result) == old_insert_refnrs(result)
+            n += 1
+    assert n > 1000
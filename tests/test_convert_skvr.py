@@ -0,0 +1,39 @@
+import pytest
+
+from convert_skvr import convert_files, mappers, read_inputs
+from filter_items_by_year import ItemFilter
+
+
+ITEM_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<KOKO>
+  <ITEM nro="skvr{0:05d}1" y="{1}" k="k1" p="p1"><META/><TEXT><V>vaka vanha {0}</V></TEXT></ITEM>
+  <ITEM nro="skvr{0:05d}2" y="1900"><META/><TEXT><V>myöhäinen</V></TEXT></ITEM>
+</KOKO>
+'''
+
+
+def write_files(tmp_path, n):
+    filenames = []
+    for i in range(n):
+        path = tmp_path / 'skvr_{:03d}.xml'.format(i)
+        path.write_text(ITEM_XML.format(i, 1800 + i % 40), encoding='utf-8')
+        filenames.append(str(path))
+    return filenames
+
+
+# more files than the pipe to the workers can hold; with the cache, the
+# second run reads the logs from the cached shards
+@pytest.mark.parametrize('workers,cache', [(4, False), (1, True)])
+def test_one_log_per_file(tmp_path, workers, cache):
+    filenames = write_files(tmp_path, 300)
+    (tmp_path / 'out').mkdir()
+    for run in range(2 if cache else 1):
+        item_filter = ItemFilter(max_year=1848)
+        convert_files(filenames, read_inputs, ('skvr_', 'skvr'),
+                      { 'verses.csv': mappers['verses.csv'] },
+                      output_dir=str(tmp_path / 'out'), item_filter=item_filter,
+                      workers=workers,
+                      cache_dir=str(tmp_path / 'cache') if cache else None)
+        assert [summary for exceptions, summary in item_filter.logs] == [
+            '{}: Processed 2 items, included 1 items, 50.00% included.\n'.format(f)
+            for f in filenames]
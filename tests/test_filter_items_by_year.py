@@ -0,0 +1,97 @@
+import json
+
+from lxml import etree
+
+from filter_items_by_year import ItemFilter, filter_file, filter_file_streaming, \
+    filter_file_subsets, read_subsets
+
+
+NESTED_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<!-- leading comment -->
+<KOKO>
+  <!-- before the first item -->
+  <ITEM nro="a1" y="1800" p="x" k="k1"><V>one</V>
+    <ITEM nro="a2" y="1900"><V>nested, rejected</V></ITEM>
+    <ITEM nro="a3" y="1801"><V>nested, kept</V></ITEM>
+  </ITEM>
+  <?pi data?>
+  <ITEM nro="b1" y="1900"><V>rejected</V><ITEM nro="b2" y="1700"/></ITEM>
+  <SECT><ITEM nro="c1" y="1700"/><ITEM nro="c2" y="1950"/></SECT>
+  <ITEM nro="d1" y="bad"/>
+  <ITEM nro="e1" y="1840"/>
+</KOKO>
+<!-- trailing comment -->
+<?trailing pi?>
+'''
+
+
+def write_input(tmp_path, text):
+    path = tmp_path / 'input.xml'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_streaming_same_as_in_memory(tmp_path):
+    input_file = write_input(tmp_path, NESTED_XML)
+    expected = filter_file(input_file, str(tmp_path / 'a.xml'), 1848)
+    result = filter_file_streaming(input_file, str(tmp_path / 'b.xml'), 1848)
+    assert result == expected
+    output = (tmp_path / 'b.xml').read_bytes()
+    assert output == (tmp_path / 'a.xml').read_bytes()
+    assert b'nested, kept' in output
+    assert b'nested, rejected' not in output
+    assert b'<!-- trailing comment -->' in output
+
+
+def test_streaming_nothing_kept(tmp_path):
+    input_file = write_input(tmp_path, NESTED_XML)
+    exceptions, summary = filter_file_streaming(input_file, str(tmp_path / 'b.xml'), 1000)
+    assert not (tmp_path / 'b.xml').exists()
+    assert not (tmp_path / 'b.xml.part').exists()
+    assert exceptions[-1].endswith('No valid <ITEM> elements remaining after filtering.\n')
+
+
+def item_numbers(filename):
+    return [item.get('nro') for item in etree.parse(filename).iter('ITEM')]
+
+
+def test_subsets_with_nested_items(tmp_path):
+    input_file = write_input(tmp_path, NESTED_XML)
+    subsets_file = tmp_path / 'subsets.json'
+    subsets_file.write_text(json.dumps({
+        'early': {'max_year': 1800},
+        'a': {'nro': 'a.*'},
+        'k1': {'k': 'k1', 'min_year': 1800},
+    }))
+    subsets = read_subsets(str(subsets_file))
+    logs = filter_file_subsets(
+        input_file, [(subset, str(tmp_path / (subset.name + '.xml'))) for subset in subsets])
+    # b2 is accepted, but nested in a rejected item
+    assert item_numbers(tmp_path / 'early.xml') == ['a1', 'c1']
+    assert item_numbers(tmp_path / 'a.xml') == ['a1', 'a2', 'a3']
+    assert item_numbers(tmp_path / 'k1.xml') == ['a1']
+    assert [summary for exceptions, summary in logs] == [
+        f'{input_file}: Processed 9 items, included {n} items, {p} included.\n'
+        for n, p in ((3, '33.33%'), (3, '33.33%'), (1, '11.11%'))]
+
+
+def test_item_filter_counts_nested_items(tmp_path):
+    # the converters only see the items that are children of the root
+    input_file = write_input(tmp_path, '\n'.join(
+        line for line in NESTED_XML.split('\n') if '<SECT>' not in line))
+    expected = filter_file(input_file, str(tmp_path / 'a.xml'), 1848)
+    item_filter = ItemFilter(max_year=1848)
+    for item in etree.parse(input_file).getroot().iterchildren('ITEM'):
+        item_filter(input_file, item, nested=True)
+    item_filter.finish_file(input_file)
+    assert item_filter.logs == [expected]
+
+
+def test_item_filter_logs_replaced_on_rerun(tmp_path):
+    input_file = write_input(tmp_path, NESTED_XML)
+    for i in range(2):
+        item_filter = ItemFilter(max_year=1848)
+        item_filter(input_file, etree.parse(input_file).find('ITEM'))
+        item_filter.finish_file(input_file)
+        item_filter.write_logs(str(tmp_path))
+    assert len((tmp_path / 'filtering.log').read_text().splitlines()) == 1
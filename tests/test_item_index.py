@@ -0,0 +1,29 @@
+from lxml import etree
+
+from item_index import ATTRIBUTES, parse_items, scan_file
+
+
+XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<KOKO>
+  <!-- <ITEM nro="commented"/> -->
+  <ITEM nro="a1" p="x&amp;y" k="&#107;1;&#x6B;2" y="18&#52;0"><TEOS>Runo &lt;1&gt;</TEOS>
+    <ITEM nro="a2" p="line
+break" k="&quot;k&apos;"><TEOS>inner</TEOS></ITEM>
+    <ITEM nro="a3" y="1850"/>
+  </ITEM>
+  <ITEM nro='b1' p="tab	here"><![CDATA[<ITEM nro="cdata">]]></ITEM>
+</KOKO>
+'''
+
+
+def test_scan_same_as_parser(tmp_path):
+    path = tmp_path / 'input.xml'
+    path.write_text(XML, encoding='utf-8')
+    entries = list(scan_file(str(path)))
+    items = list(etree.parse(str(path)).iter('ITEM'))
+    assert [e['nro'] for e in entries] == ['a1', 'a2', 'a3', 'b1']
+    for entry, item in zip(entries, items):
+        assert {a: entry[a] for a in ATTRIBUTES} == {a: item.get(a, '') for a in ATTRIBUTES}
+    assert entries[0]['teos'] == 'Runo <1>'
+    for entry, parsed in zip(entries, parse_items(entries)):
+        assert parsed.get('nro') == entry['nro']
@@ -0,0 +1,15 @@
+import pytest
+
+from map_columns import ColumnMapper, map_rows
+
+
+@pytest.mark.parametrize('hashed', [False, True])
+def test_map_rows_unique(hashed):
+    mapper = ColumnMapper({ ('1',): ('x',), ('2',): ('y',) },
+                          ['id', 'a', 'z'], ['a'], ['b'])
+    rows = [['1', '1', 'q'], ['2', '2', 'r'], ['3', '9', 's'], ['1', '1', 'q'], ['4', '1', 'q']]
+    assert mapper.fieldnames == ['id', 'b', 'z']
+    assert list(map_rows(rows, [mapper])) == \
+        [['1', 'x', 'q'], ['2', 'y', 'r'], ['1', 'x', 'q'], ['4', 'x', 'q']]
+    assert list(map_rows(rows, [mapper], unique=True, hashed=hashed)) == \
+        [['1', 'x', 'q'], ['2', 'y', 'r'], ['4', 'x', 'q']]
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from verse_index import VerseIndex
+
+
+VERSES = ['vaka vanha väinämöinen', 'tietäjä iän-ikuinen', 'vaka vanha väinämöinen',
+          'laulaja iän-ikuinen', 'lähe kanssa laulamahan', 'sanelemaan saaossa']
+
+
+def build_index(n=2, dim=20, weighting='plain'):
+    verses = list(dict.fromkeys(VERSES))
+    occurrences = [(verses.index(v), 'p1', str(i+1)) for i, v in enumerate(VERSES)]
+    return VerseIndex.build(verses, occurrences, n=n, dim=dim, weighting=weighting)
+
+
+@pytest.mark.parametrize('weighting', ['plain', 'sqrt', 'binary'])
+def test_vectors_same_as_shortsim(weighting):
+    ngrcos = pytest.importorskip('shortsim.ngrcos')
+    index = build_index(weighting=weighting)
+    expected = ngrcos.vectorize(index.verses, n=2, dim=20, weighting=weighting)
+    np.testing.assert_allclose(index.vectors, expected, rtol=1e-6)
+
+
+def test_save_and_query(tmp_path):
+    index = build_index()
+    index.save(str(tmp_path / 'index.npz'))
+    loaded = VerseIndex.load(str(tmp_path / 'index.npz'))
+    assert loaded.verses == index.verses
+    np.testing.assert_array_equal(loaded.vectors, index.vectors)
+    [results] = loaded.search(['vaka vanha väinämöinen'], k=2)
+    text, sim, occurrences = results[0]
+    assert text == 'vaka vanha väinämöinen'
+    assert sim == pytest.approx(1.0)
+    assert occurrences == [('p1', 1), ('p1', 3)]